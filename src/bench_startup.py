@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Startup time benchmark: how long a fresh interpreter (e.g. a worker process) takes to import the pipeline, with and
+without the GUI toolkit that cdrmapper.py used to import at module load.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+SCENARIOS = [
+    ('pipeline (no GUI)', 'import pipeline'),
+    ('front end (GUI loaded lazily)', 'import cdrmapper'),
+    ('pipeline + easygui/Tk (previous behavior)', 'import easygui, Tkinter, pipeline'),
+]
+
+
+def time_import(statement, runs):
+    """
+    Times a statement in fresh interpreters
+    :param statement: python source to run
+    :param runs: number of interpreters to start
+    :return: median wall clock time in seconds, or None if the statement fails (e.g. easygui is not installed)
+    """
+    timings = []
+    for i in xrange(runs):
+        start = time.time()
+        if subprocess.call([sys.executable, '-c', statement], cwd=os.path.dirname(os.path.abspath(__file__))):
+            return None
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main(argv):
+    runs = int(argv[1]) if len(argv) > 1 else 10
+    baseline = time_import('pass', runs)
+    sys.stdout.write('%-45s %8.1f ms\n' % ('empty interpreter', baseline * 1000))
+    for name, statement in SCENARIOS:
+        median = time_import(statement, runs)
+        if median is None:
+            sys.stdout.write('%-45s %11s\n' % (name, 'failed'))
+        else:
+            sys.stdout.write('%-45s %8.1f ms\n' % (name, median * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -4,10 +4,13 @@ CDR Mapper GUI application
 """
 
 import csv
-import easygui
+import importlib
+import multiprocessing
 import os
 import sys
-from models import Database, TollsCase, Tower, CDR, Report
+from exporters import EXPORT_FORMATS
+from models import TollsCase
+from pipeline import initialize_database, describe_rejected, load_same_file, load_two_files, export_report
 
 
 __author__ = "Dan O'Day"
@@ -21,6 +24,24 @@ __status__ = "Prototype"
 RESOURCES_FOLDER = r'C:\Users\dday\PycharmProjects\cdr-mapper\cdr-mapper\resources'
 
 
+class LazyModule(object):
+    """
+    Imports a module the first time one of its attributes is used
+    """
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+
+# easygui pulls in Tk, so it is only imported once the first dialog is shown (worker processes never show any)
+easygui = LazyModule('easygui')
+
+
 def validate_fields(fields):
     """
     Check if all fields in list have values
@@ -57,6 +78,7 @@ def get_case_details():
             valid = validate_fields(case_details)
         i += 1
 
+    initialize_database(case_details[0])
     tc = TollsCase(case_details[0], case_details[1], case_details[2], case_details[3], case_details[4])
     tc.save()
     return tc.case_unique_id
@@ -109,11 +131,10 @@ def get_save_location(message):
     return d
 
 
-def import_tower_data(case_id):
+def select_tower_data():
     """
-    Imports tower data when towers are separate from CDR data
-    :param case_id: primary key of case
-    :return: n/a
+    Gets tower file and its columns when towers are separate from CDR data
+    :return: tuple of (tower file path, column indexes of cell site / tower ID, latitude, longitude, sector, azimuth)
     """
     cell_site = None
     latitude = None
@@ -155,27 +176,14 @@ def import_tower_data(case_id):
     i_sector = headers.index(sector)
     i_azimuth = headers.index(azimuth)
 
-    easygui.msgbox(msg=' '.join(["Importing the towers may take several minutes. The application will run in the",
-                                 "background while the tower import process is running. A message will be displayed",
-                                 "to you once the import is finished. Click OK to begin the import."]),
-                   title="Loading Warning")
+    return tower_file, i_cell_site, i_latitude, i_longitude, i_sector, i_azimuth
 
-    with open(tower_file, 'rb') as f:
-        f_csv = csv.reader(f)
-        discarded_headers = next(f_csv)
 
-        for row in f_csv:
-            t = Tower(case_id, row[i_cell_site], row[i_latitude], row[i_longitude], row[i_sector], row[i_azimuth])
-            t.save()
-
-    easygui.msgbox(msg='Towers imported successfully.', title="Success")
-
-
-def import_cdrs(case_id):
+def select_cdrs():
     """
-    Imports CDR data when CDRs are separate from tower data
-    :param case_id: primary key of case
-    :return: n/a
+    Gets CDR file and its columns when CDRs are separate from tower data
+    :return: tuple of (CDR file path, column indexes of called number, cell site / tower ID, and sector, dictionary of
+             report field names to column indexes)
     """
     called_number = None
     cell_site_id = None
@@ -214,42 +222,34 @@ def import_cdrs(case_id):
     d_other_fields = {of: headers.index(of) for of in other_fields if headers.index(of) not in knowns
                       and of.strip() != ''}  # remove knowns
 
-    easygui.msgbox(msg=' '.join(["Importing the CDRs may take several minutes. The application will run in the",
-                                 "background while the CDR import process is running. A message will be displayed",
-                                 "to you once the import is finished. Click OK to begin the import."]),
-                   title="Loading Warning")
-
-    with open(cdr_file, 'rb') as f:
-        f_csv = csv.reader(f)
-        discarded_headers = next(f_csv)
+    return cdr_file, i_called_number, i_cell_site_id, i_sector, d_other_fields
 
-        for row in f_csv:
-            report_fields = {}
-            for k, v in d_other_fields.iteritems():
-                report_fields[k] = row[v]
 
-            cdr = CDR(case_id, row[i_called_number], row[i_cell_site_id], row[i_sector], report_fields)
-            cdr.save()
-
-    easygui.msgbox(msg='CDRs imported successfully.', title="Success")
+def select_report_options():
+    """
+    Gets report options from user
+    :return: tuple of (directory path where report is saved, True if points should be clustered, list of formats)
+    """
+    save_location = get_save_location("Please select the folder where you want to save the report.")
+    cluster = easygui.ynbox(msg=' '.join(["Group nearby points into clusters when zoomed out? This keeps maps with",
+                                          "many records readable and fast."]), title="Clustering")
+    formats = easygui.multchoicebox(' '.join(["Select the file formats to save. All of them are written in a single",
+                                              "pass over the data."]), title="Formats",
+                                    choices=sorted(EXPORT_FORMATS))
+    return save_location, cluster, formats or ['kml']
 
 
-def save_report(case_id, report_data=None):
-    save_location = get_save_location("Please select the folder where you want to save the report.")
-    if not report_data:
-        final_report = Report(case_id, False, save_location)
-    else:
-        final_report = Report(case_id, True, save_location)
+def save_report(case_id, report_data=None, save_location=None, cluster=False, formats=('kml',)):
+    if not save_location:
+        save_location, cluster, formats = select_report_options()
 
     report_name = None
     i = 0
     while not report_name:
         try:
             i += 1
-            if not report_data:
-                report_name = final_report.generate_map()
-            else:
-                report_name = final_report.generate_map(data=report_data)
+            report_name = ', '.join(export_report(case_id, save_location, report_data=report_data, cluster=cluster,
+                                                  formats=formats))
         except IOError:
             easygui.msgbox(msg="There was an error writing the report file.")
             report_name = get_file("Please select the location where you wish to save the report again.")
@@ -271,7 +271,6 @@ def parse_same_file(case_id):
     latitude = None
     longitude = None
     other_fields = None
-    report_data = {}
 
     # get headers
     while not latitude:
@@ -294,20 +293,9 @@ def parse_same_file(case_id):
     d_other_fields = {of: headers.index(of) for of in other_fields if headers.index(of) not in knowns
                       and of.strip() != ''}  # remove knowns
 
-    with open(data, 'rb') as f:
-        f_csv = csv.reader(f)
-        discarded_headers = next(f_csv)
-        i = 1
-        for row in f_csv:
-            report_fields = {}
-            other = {}
-            for k, v in d_other_fields.iteritems():
-                other[k] = row[v]
-            report_fields['Other Fields'] = other
-            report_fields['Latitude'] = row[i_latitude]
-            report_fields['Longitude'] = row[i_longitude]
-            report_data[i] = report_fields
-            i += 1
+    report_data, rejected = load_same_file(data, i_latitude, i_longitude, d_other_fields)
+    if rejected:
+        easygui.msgbox(msg=describe_rejected(rejected), title="Warning")
 
     save_report(case_id, report_data=report_data)
 
@@ -318,9 +306,20 @@ def parse_two_files(case_id):
     :param case_id: primary key of case
     :return: n/a
     """
-    import_tower_data(case_id)
-    import_cdrs(case_id)
-    save_report(case_id)
+    tower_columns = select_tower_data()
+    cdr_columns = select_cdrs()
+    save_location, cluster, formats = select_report_options()
+
+    easygui.msgbox(msg=' '.join(["Importing the towers and CDRs may take several minutes. The application will run in",
+                                 "the background while the import process is running. The report will be generated",
+                                 "as soon as the import is finished. Click OK to begin the import."]),
+                   title="Loading Warning")
+
+    rejected = load_two_files(case_id, tower_columns, cdr_columns)
+    if rejected:
+        easygui.msgbox(msg=describe_rejected(rejected), title="Warning")
+
+    save_report(case_id, save_location=save_location, cluster=cluster, formats=formats)
 
 
 def main():
@@ -342,7 +341,6 @@ def main():
                       title="DISCLAIMER", choices=["I understand and accept these terms"],
                       image=os.path.join(RESOURCES_FOLDER, 'tower.gif'))
 
-    initialize_database()
     case_id = get_case_details()
 
     if easygui.ynbox(msg="Are your CDR and cell site / tower data in the same CSV file?", title="Main Menu"):
@@ -351,29 +349,7 @@ def main():
         parse_two_files(case_id)
 
 
-def initialize_database():
-    """
-    Initializes database
-    :return: destroys existing database and creates new one for new case
-    """
-    database = Database()
-    if not os.path.isfile(database.database_filename):
-        database.create_tables()
-    else:
-        destroy_database()
-        database.create_tables()
-
-
-def destroy_database():
-    """
-    Delete sqlite database
-    :return: database is deleted
-    """
-    database = Database()
-    if os.path.isfile(database.database_filename):
-        os.remove(database.database_filename)
-
-
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # parser processes in load_two_files need this in the frozen Windows build
     main()
-    sys.exit(0)
\ No newline at end of file
+    sys.exit(0)
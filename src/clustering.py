@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Quadtree grid clustering of map points at several zoom levels, so dense maps can be drawn as a few hundred clusters.
+"""
+
+import numpy as np
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+# quadtree zoom levels; a cell at zoom z is 360 / 2**z degrees square (zoom 15 is roughly 1 km)
+DEFAULT_ZOOM_LEVELS = (6, 9, 12, 15)
+
+
+def cell_size(zoom):
+    """
+    Size of grid cell at a zoom level
+    :param zoom: quadtree zoom level
+    :return: cell size in degrees
+    """
+    return 360.0 / (1 << zoom)
+
+
+class ClusterLevel(object):
+    """
+    Clusters at a single zoom level, stored as parallel arrays (one element per non-empty grid cell).
+    """
+    def __init__(self, zoom, rows, cols, counts, latitudes, longitudes):
+        self.zoom = zoom
+        self.rows = rows
+        self.cols = cols
+        self.counts = counts
+        self.latitudes = latitudes  # centroid of points in cell
+        self.longitudes = longitudes
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __str__(self):
+        return ''.join(('Zoom ', str(self.zoom), ' (', str(len(self)), ' clusters)'))
+
+    def __repr__(self):
+        return ''.join(('ClusterLevel(', repr(self.zoom), ', ', repr(len(self)), ')'))
+
+    def bounds(self):
+        """
+        Grid cell bounds of each cluster
+        :return: tuple of (south, west, north, east) float arrays
+        """
+        size = cell_size(self.zoom)
+        south = self.rows * size - 90.0
+        west = self.cols * size - 180.0
+        return south, west, np.minimum(south + size, 90.0), np.minimum(west + size, 180.0)
+
+
+def build_clusters(latitudes, longitudes, zoom_levels=DEFAULT_ZOOM_LEVELS, weights=None):
+    """
+    Bins points into grid cells at every zoom level. Points are only binned once, at the finest level; coarser levels
+    are aggregated from the (much smaller) set of finest cells.
+    :param latitudes: latitudes in decimal degrees
+    :param longitudes: longitudes in decimal degrees
+    :param zoom_levels: quadtree zoom levels to cluster at
+    :param weights: number of records at each point (e.g. CDRs per tower), or None for one record per point
+    :return: tuple of (list of ClusterLevel objects from coarsest to finest, array giving the index of each point's
+             cell in the finest level)
+    """
+    zooms = sorted(set(zoom_levels))
+    finest = zooms[-1]
+    latitude = np.asarray(latitudes, dtype=np.float64)
+    longitude = np.asarray(longitudes, dtype=np.float64)
+
+    size = cell_size(finest)
+    max_index = (1 << finest) - 1
+    rows = np.clip(np.floor((latitude + 90.0) / size).astype(np.int64), 0, max_index)
+    cols = np.clip(np.floor((longitude + 180.0) / size).astype(np.int64), 0, max_index)
+    cell_keys, point_cells = np.unique((rows << finest) | cols, return_inverse=True)
+    if weights is None:
+        weight = np.ones(latitude.shape)
+    else:
+        weight = np.asarray(weights, dtype=np.float64)
+    cell_counts = np.bincount(point_cells, weights=weight)
+    cell_lat_sums = np.bincount(point_cells, weights=latitude * weight)
+    cell_lon_sums = np.bincount(point_cells, weights=longitude * weight)
+    cell_rows = cell_keys >> finest
+    cell_cols = cell_keys & max_index
+
+    levels = []
+    for zoom in zooms:
+        shift = finest - zoom
+        keys, cells = np.unique(((cell_rows >> shift) << zoom) | (cell_cols >> shift), return_inverse=True)
+        counts = np.bincount(cells, weights=cell_counts)
+        levels.append(ClusterLevel(zoom, keys >> zoom, keys & ((1 << zoom) - 1), counts.astype(np.int64),
+                                   np.bincount(cells, weights=cell_lat_sums) / counts,
+                                   np.bincount(cells, weights=cell_lon_sums) / counts))
+    return levels, point_cells
+
+
+def lod_ranges(levels, max_lod_pixels):
+    """
+    Region LOD pixel ranges so that exactly one level is drawn at a time: a level is replaced by the next finer one
+    once its cells grow past max_lod_pixels on screen.
+    :param levels: list of ClusterLevel objects from coarsest to finest
+    :param max_lod_pixels: on-screen size of a cell (in pixels) at which the next finer level takes over
+    :return: list of (minLodPixels, maxLodPixels) tuples, one per level, plus one final range for individual points
+    """
+    ranges = []
+    previous_zoom = None
+    for level in levels:
+        if previous_zoom is None:
+            min_pixels = 0
+        else:
+            min_pixels = max_lod_pixels / (1 << (level.zoom - previous_zoom))
+        ranges.append((min_pixels, max_lod_pixels))
+        previous_zoom = level.zoom
+    ranges.append((max_lod_pixels, -1))
+    return ranges
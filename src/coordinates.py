@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Batched parsing, validation, and normalization of latitude / longitude columns.
+"""
+
+import re
+import numpy as np
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+# status codes returned by validate_coordinates()
+COORDINATE_OK = 0
+COORDINATE_MISSING = 1
+COORDINATE_UNPARSEABLE = 2
+COORDINATE_OUT_OF_RANGE = 3
+COORDINATE_SWAPPED = 4  # latitude out of range but would be valid as longitude; columns probably mixed up
+COORDINATE_NULL_ISLAND = 5  # 0, 0 is a common carrier placeholder for unknown locations
+
+STATUS_DESCRIPTIONS = {
+    COORDINATE_OK: 'OK',
+    COORDINATE_MISSING: 'Missing',
+    COORDINATE_UNPARSEABLE: 'Unparseable',
+    COORDINATE_OUT_OF_RANGE: 'Out of range',
+    COORDINATE_SWAPPED: 'Latitude and longitude swapped',
+    COORDINATE_NULL_ISLAND: 'Placeholder (0, 0)'
+}
+
+DECIMAL_CHARS = '0123456789.+-'
+DECIMAL_BYTES = np.zeros(256, dtype=bool)  # lookup table of bytes allowed in fixed-width decimal strings
+DECIMAL_BYTES[[ord(c) for c in DECIMAL_CHARS + '\x00']] = True  # NUL pads shorter strings
+DMS_PATTERN = re.compile(r"""^([NSEW+-]?)\s*
+                             (\d+(?:\.\d*)?)(?:[^\d.NSEW]+(\d+(?:\.\d*)?))?(?:[^\d.NSEW]+(\d+(?:\.\d*)?))?
+                             [^\d.NSEW]*([NSEW]?)$""", re.VERBOSE)
+
+
+def parse_dms(s):
+    """
+    Parses a single degrees / minutes / seconds string such as 40 26' 46.3" N or -75:09:02 (also accepts decimal
+    degrees with a hemisphere letter, such as 75.5W)
+    :param s: upper case, whitespace-stripped string
+    :return: decimal degrees as float, or NaN if not parseable
+    """
+    match = DMS_PATTERN.match(s)
+    if not match:
+        return np.nan
+    prefix, degrees, minutes, seconds, suffix = match.groups()
+    if prefix and suffix and prefix in 'NSEW':
+        return np.nan  # hemisphere given twice
+    minutes = float(minutes or 0)
+    seconds = float(seconds or 0)
+    if minutes >= 60 or seconds >= 60:
+        return np.nan
+    value = float(degrees) + minutes / 60.0 + seconds / 3600.0
+    if prefix in ('-', 'S', 'W') or suffix in ('S', 'W'):
+        value = -value
+    return value
+
+
+def parse_coordinates(values):
+    """
+    Parses a whole column of coordinates in decimal degrees or DMS notation. Clean decimal columns (the usual case)
+    are converted in bulk by numpy; only rows that are not plain decimal numbers are handled individually.
+    :param values: list (or array) of strings
+    :return: tuple of (float64 array of decimal degrees, NaN where not parseable; boolean array of missing values)
+    """
+    try:
+        degrees = np.array(values, dtype=np.float64).reshape(-1)
+        return degrees, np.zeros(degrees.shape, dtype=bool)
+    except ValueError:
+        pass
+
+    text = np.asarray(values, dtype=np.str_)
+    degrees = np.full(text.shape, np.nan)
+    present = (text != '') & (text != 'NA')
+    try:
+        degrees[present] = text[present].astype(np.float64)
+        return degrees, ~present
+    except ValueError:
+        pass
+
+    # slow path: normalize the remaining rows, convert the plain decimal ones in bulk, and only handle DMS values (and
+    # decimal characters in an invalid arrangement, e.g. '1-2') one at a time
+    rows = np.flatnonzero(present)
+    if not len(rows):
+        return degrees, ~present
+    cleaned = np.char.strip(np.char.upper(text[rows]))
+    blank = (cleaned == '') | (cleaned == 'NA')
+    missing = ~present
+    missing[rows[blank]] = True
+    decimal = DECIMAL_BYTES[cleaned.view(np.uint8).reshape(len(cleaned), -1)].all(axis=1) & ~blank
+    try:
+        degrees[rows[decimal]] = cleaned[decimal].astype(np.float64)
+        other = np.flatnonzero(~decimal & ~blank)
+    except ValueError:
+        other = np.flatnonzero(~blank)
+    for j in other:
+        s = cleaned[j]
+        if decimal[j]:
+            try:
+                degrees[rows[j]] = float(s)
+                continue
+            except ValueError:
+                pass
+        degrees[rows[j]] = parse_dms(s)
+    return degrees, missing
+
+
+def validate_coordinates(latitudes, longitudes):
+    """
+    Parses and range-checks latitude and longitude columns
+    :param latitudes: list (or array) of latitude strings
+    :param longitudes: list (or array) of longitude strings
+    :return: tuple of (latitude float array, longitude float array, uint8 array of COORDINATE_* status codes)
+    """
+    latitude, lat_missing = parse_coordinates(latitudes)
+    longitude, lon_missing = parse_coordinates(longitudes)
+
+    status = np.zeros(latitude.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):  # NaN comparisons are False, and NaN rows are flagged as unparseable anyway
+        abs_latitude = np.abs(latitude)
+        abs_longitude = np.abs(longitude)
+        out_of_range = (abs_latitude > 90) | (abs_longitude > 180)
+        swapped = (abs_latitude > 90) & (abs_latitude <= 180) & (abs_longitude <= 90)
+        null_island = (latitude == 0) & (longitude == 0)
+
+    # assigned from least to most specific so the most useful reason wins
+    status[null_island] = COORDINATE_NULL_ISLAND
+    status[out_of_range] = COORDINATE_OUT_OF_RANGE
+    status[swapped] = COORDINATE_SWAPPED
+    status[np.isnan(latitude) | np.isnan(longitude)] = COORDINATE_UNPARSEABLE
+    status[lat_missing | lon_missing] = COORDINATE_MISSING
+    return latitude, longitude, status
+
+
+def summarize_status(status):
+    """
+    Counts rows per problem so they can be reported to the user
+    :param status: array of COORDINATE_* status codes
+    :return: dictionary of status description to number of rows, excluding valid rows
+    """
+    counts = np.bincount(status, minlength=len(STATUS_DESCRIPTIONS))
+    return {STATUS_DESCRIPTIONS[code]: int(count) for code, count in enumerate(counts)
+            if code != COORDINATE_OK and count}
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Duplicate record detection during import (carrier returns often overlap or repeat the same records).
+"""
+
+import cStringIO
+import hashlib
+import numpy as np
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+DUPLICATE_DESCRIPTION = 'Duplicate record'
+
+
+def digest_keys(keys):
+    """
+    Reduces keys to 16 byte digests written one after another into a single buffer (no Python object per record)
+    :param keys: iterable of key strings, one per row (e.g. the key columns joined by NUL)
+    :return: array of digests (dtype S16), one per row
+    """
+    md5 = hashlib.md5
+    digests = cStringIO.StringIO()
+    write = digests.write
+    for key in keys:
+        write(md5(key).digest())
+    return np.frombuffer(digests.getvalue(), dtype='S16')
+
+
+class DuplicateFilter(object):
+    """
+    Finds the first record with each key. Keys are reduced to 16 byte digests (see digest_keys), so even very large
+    imports fit in memory; first occurrences are then found with one NumPy sort.
+    """
+    def __init__(self):
+        self.count = 0
+        self.removed = 0
+
+    def __str__(self):
+        return ''.join(('DuplicateFilter (', str(self.count), ' keys, ', str(self.removed), ' removed)'))
+
+    def __repr__(self):
+        return 'DuplicateFilter()'
+
+    def unique_rows(self, keys):
+        """
+        Finds rows whose key does not repeat an earlier row's key
+        :param keys: iterable of key strings, one per row (e.g. the key columns joined by NUL)
+        :return: sorted int array of indexes of rows to keep
+        """
+        return self.unique_digests(digest_keys(keys))
+
+    def unique_digests(self, digests):
+        """
+        Finds rows whose key digest does not repeat an earlier row's
+        :param digests: array of digests from digest_keys() (e.g. loaded from a snapshot), one per row
+        :return: sorted int array of indexes of rows to keep
+        """
+        # digests are all 16 bytes, so trailing NULs in them cannot make two different digests equal
+        keep = np.sort(np.unique(digests, return_index=True)[1])
+        self.count += len(digests)
+        self.removed += len(digests) - len(keep)
+        return keep
+
+    def summarize(self):
+        """
+        :return: dictionary of problem description to number of records removed (empty if none were)
+        """
+        return {DUPLICATE_DESCRIPTION: self.removed} if self.removed else {}
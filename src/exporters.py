@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Report output formats besides plain KML. Every sink renders map points as Report.export() resolves them and the text
+is streamed to disk, so any number of formats can be written in a single pass over the data.
+"""
+
+import cStringIO
+import csv
+import json
+import os
+import tempfile
+import zipfile
+from heatmap import DensityGrid, render_heatmap
+from models import Report, ReportSink, KMLSink
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+def decode_text(value):
+    """
+    Decodes text read from a CSV file, which is usually UTF-8 but often Windows / Latin-1 text from older exports
+    :param value: byte string (other values are returned unchanged)
+    :return: unicode string
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')  # every byte is valid Latin-1, so this cannot fail
+
+
+class KMZSink(KMLSink):
+    """
+    Zipped KML map file. The KML is streamed to a temporary file next to the KMZ and compressed once it is complete.
+    """
+    extension = '.kmz'
+
+    def __init__(self, report, path):
+        super(KMZSink, self).__init__(report, path)
+        self.kmz_path = path
+        self.kml_path = None
+
+    def open(self):
+        fd, self.kml_path = tempfile.mkstemp(suffix='.kml', dir=os.path.dirname(os.path.abspath(self.kmz_path)))
+        os.close(fd)
+        self.path = self.kml_path
+        super(KMZSink, self).open()
+        self.path = self.kmz_path
+
+    def finish(self):
+        super(KMZSink, self).finish()
+        self.f.close()
+        self.f = None
+        with zipfile.ZipFile(self.kmz_path, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            kmz.write(self.kml_path, 'doc.kml')
+
+    def close(self):
+        super(KMZSink, self).close()
+        if self.kml_path and os.path.isfile(self.kml_path):
+            os.remove(self.kml_path)
+        self.kml_path = None
+
+
+class GeoJSONSink(ReportSink):
+    """
+    GeoJSON FeatureCollection with one Point feature per record; report fields become feature properties.
+    """
+    extension = '.geojson'
+
+    def __init__(self, report, path):
+        super(GeoJSONSink, self).__init__(report, path)
+        self.count = 0
+
+    def header(self):
+        return '{"type": "FeatureCollection", "features": [\n'
+
+    def render(self, batch):
+        features = []
+        for cdr_id, latitude, longitude, other in batch.records():
+            features.append(json.dumps({'type': 'Feature',
+                                        'id': cdr_id,
+                                        'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                                        'properties': {decode_text(k): decode_text(v)
+                                                       for k, v in other.iteritems()}}, sort_keys=True))
+        if not features:
+            return ''
+        separator = ',\n' if self.count else ''
+        self.count += len(features)
+        return ''.join([separator, ',\n'.join(features)])
+
+    def footer(self):
+        return '\n]}\n'
+
+
+class CSVSink(ReportSink):
+    """
+    Flat CSV file with one row per record: CDR ID, latitude, longitude, then the report fields in alphabetical order.
+    """
+    extension = '.csv'
+
+    def __init__(self, report, path):
+        super(CSVSink, self).__init__(report, path)
+        self.buffer = cStringIO.StringIO()  # rows are rendered here, then handed to the writer as one string
+        self.writer = csv.writer(self.buffer)
+        self.field_names = None
+
+    def flush_rows(self):
+        """
+        :return: rows rendered since the last call, as CSV text
+        """
+        rows = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return rows
+
+    def render(self, batch):
+        writerow = self.writer.writerow
+        for cdr_id, latitude, longitude, other in batch.records():
+            if self.field_names is None:  # every record of a report has the same fields
+                self.field_names = sorted(other)
+                writerow(['CDR ID', 'Latitude', 'Longitude'] + self.field_names)
+            writerow([cdr_id, latitude, longitude] + [other.get(k, '') for k in self.field_names])
+        return self.flush_rows()
+
+    def footer(self):
+        if self.field_names is None:
+            self.writer.writerow(['CDR ID', 'Latitude', 'Longitude'])
+        return self.flush_rows()
+
+
+class HeatmapSink(ReportSink):
+    """
+    KMZ file with a density heatmap of all records instead of one placemark per record, so it stays small and loads
+    instantly however large the case is. The heatmap is drawn as PNG ground overlays stored inside the KMZ.
+    """
+    extension = '.heatmap.kmz'
+
+    def __init__(self, report, path):
+        super(HeatmapSink, self).__init__(report, path)
+        self.grid = DensityGrid()
+
+    def render(self, batch):
+        self.grid.add(batch.latitudes, batch.longitudes)
+        return ''
+
+    def finish(self):
+        overlays = []
+        images = []
+        for i, (south, west, north, east, png) in enumerate(render_heatmap(self.grid)):
+            name = 'heatmap/%d.png' % i
+            images.append((name, png))
+            overlays.append("""
+            <GroundOverlay>
+                <name>Density {number}</name>
+                <Icon>
+                    <href>{name}</href>
+                </Icon>
+                <LatLonBox>
+                    <north>{north}</north>
+                    <south>{south}</south>
+                    <east>{east}</east>
+                    <west>{west}</west>
+                </LatLonBox>
+            </GroundOverlay>""".format(number=i + 1, name=name, north=repr(north), south=repr(south),
+                                       east=repr(east), west=repr(west)))
+        kml = ''.join([self.report.get_kml_header(),
+                       '<Folder><name>Density (', str(len(self.grid)), ' records)</name>',
+                       ''.join(overlays), """
+            </Folder>
+            </Document>
+        </kml>"""])
+        with zipfile.ZipFile(self.f, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            kmz.writestr('doc.kml', Report.strip_whitespace(kml))
+            for name, png in images:
+                kmz.writestr(name, png, zipfile.ZIP_STORED)  # already compressed
+
+
+EXPORT_FORMATS = {
+    'kml': KMLSink,
+    'kmz': KMZSink,
+    'geojson': GeoJSONSink,
+    'csv': CSVSink,
+    'heatmap': HeatmapSink
+}
+
+
+def create_sinks(report, formats):
+    """
+    Creates one sink per output format, named after the report
+    :param report: Report object
+    :param formats: list of format names (keys of EXPORT_FORMATS)
+    :return: list of ReportSink objects
+    """
+    unknown = [f for f in formats if f.lower() not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(''.join(["Unknown export format: ", ', '.join(unknown)]))
+    base_name = os.path.join(report.report_path, os.path.splitext(report.report_name)[0])
+    sinks = []
+    for f in formats:
+        sink = EXPORT_FORMATS[f.lower()]
+        if sink not in [type(s) for s in sinks]:
+            sinks.append(sink(report, ''.join([base_name, sink.extension])))
+    return sinks
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+External merge sort: orders a stream of records that may be much larger than memory. Records are sorted in memory in
+runs of up to a fixed budget, spilled to temporary files, and merged back into a single stream.
+"""
+
+import heapq
+import marshal
+import struct
+import tempfile
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+DEFAULT_SORT_MEMORY = 64 * 1024 * 1024  # bytes of records held in memory before a run is spilled to disk
+MERGE_FAN_IN = 64  # most runs merged at once (each one is an open file)
+ITEM_OVERHEAD = 100  # approximate size of the Python objects holding each buffered record, besides the record data
+LENGTH = struct.Struct('<I')
+
+
+def write_run(items, temp_dir=None):
+    """
+    Writes sorted items to a temporary file (deleted when closed)
+    :param items: iterable of (key, sequence number, marshalled record) tuples, already sorted
+    :param temp_dir: directory for the file, or None for the system default
+    :return: file object positioned at the start of the run
+    """
+    f = tempfile.TemporaryFile(dir=temp_dir)
+    write = f.write
+    for item in items:
+        data = marshal.dumps(item)
+        write(LENGTH.pack(len(data)))
+        write(data)
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    """
+    Reads items written by write_run
+    :param f: file object returned by write_run
+    :return: generator of (key, sequence number, marshalled record) tuples
+    """
+    read = f.read
+    while True:
+        header = read(LENGTH.size)
+        if not header:
+            return
+        yield marshal.loads(read(LENGTH.unpack(header)[0]))
+
+
+def external_sort(records, key, memory_bytes=DEFAULT_SORT_MEMORY, temp_dir=None):
+    """
+    Sorts records without holding more than about memory_bytes of them in memory. The sort is stable, so records with
+    equal keys keep their original order.
+    :param records: iterable of records made of basic types (e.g. tuples of numbers, strings, and dictionaries)
+    :param key: function returning the sort key of a record
+    :param memory_bytes: memory budget for buffered records
+    :param temp_dir: directory for spill files, or None for the system default
+    :return: generator of records in sorted order
+    """
+    runs = []
+    try:
+        buffer = []
+        size = 0
+        for sequence, record in enumerate(records):
+            data = marshal.dumps(record)
+            buffer.append((key(record), sequence, data))  # unique sequence numbers keep records out of comparisons
+            size += len(data) + ITEM_OVERHEAD
+            if size >= memory_bytes:
+                buffer.sort()
+                runs.append(write_run(buffer, temp_dir))
+                buffer = []
+                size = 0
+        buffer.sort()
+
+        if not runs:  # everything fit in memory
+            for item in buffer:
+                yield marshal.loads(item[2])
+            return
+        if buffer:
+            runs.append(write_run(buffer, temp_dir))
+            buffer = []
+
+        # merge in several passes if there are too many runs to keep open at once
+        while len(runs) > MERGE_FAN_IN:
+            merged = []
+            for i in xrange(0, len(runs), MERGE_FAN_IN):
+                group = runs[i:i + MERGE_FAN_IN]
+                merged.append(write_run(heapq.merge(*[read_run(f) for f in group]), temp_dir))
+                for f in group:
+                    f.close()
+            runs = merged
+
+        for item in heapq.merge(*[read_run(f) for f in runs]):
+            yield marshal.loads(item[2])
+    finally:
+        for f in runs:
+            f.close()
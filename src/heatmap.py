@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Density heatmap of map points, drawn as PNG ground overlays. Points are binned into a fine grid as they stream past, so
+memory depends on the number of occupied grid cells rather than the number of records, and the grid is then resampled
+into an image with NumPy 2D histogramming.
+"""
+
+import math
+import struct
+import zlib
+import numpy as np
+from clustering import cell_size
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+HEATMAP_ZOOM = 18  # quadtree zoom level points are binned at (roughly 150 m cells)
+HEATMAP_PIXELS = 2048  # size of the longer side of the whole heatmap image
+HEATMAP_TILE_PIXELS = 512  # the image is split into overlays of at most this size; empty tiles are left out
+HEATMAP_RADIUS_PIXELS = 6  # standard deviation of the blur that spreads each location's density
+COMPACT_CELLS = 1000000  # binned cells buffered before they are merged
+MIN_SPAN = 0.01  # smallest area drawn, in degrees (e.g. when every point is on one tower)
+
+# color ramp from sparse to dense, as (position, red, green, blue, alpha)
+COLOR_STOPS = [(0.0, 0, 0, 255, 0),
+               (0.01, 0, 0, 255, 90),
+               (0.25, 0, 255, 255, 130),
+               (0.5, 0, 255, 0, 160),
+               (0.75, 255, 255, 0, 190),
+               (1.0, 255, 0, 0, 220)]
+
+
+class DensityGrid(object):
+    """
+    Running count of points per grid cell at a fixed quadtree zoom level.
+    """
+    def __init__(self, zoom=HEATMAP_ZOOM):
+        self.zoom = zoom
+        self.keys = []  # arrays of cell keys (row << zoom | column), merged by compact()
+        self.counts = []
+        self.pending = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def __str__(self):
+        return ''.join(('DensityGrid (', str(self.total), ' points)'))
+
+    def __repr__(self):
+        return ''.join(('DensityGrid(', repr(self.zoom), ')'))
+
+    def add(self, latitudes, longitudes):
+        """
+        Bins a batch of points
+        :param latitudes: float array of latitudes in decimal degrees
+        :param longitudes: float array of longitudes in decimal degrees
+        """
+        if not len(latitudes):
+            return
+        size = cell_size(self.zoom)
+        max_index = (1 << self.zoom) - 1
+        rows = np.clip(np.floor((np.asarray(latitudes) + 90.0) / size).astype(np.int64), 0, max_index)
+        cols = np.clip(np.floor((np.asarray(longitudes) + 180.0) / size).astype(np.int64), 0, max_index)
+        keys, counts = np.unique((rows << self.zoom) | cols, return_counts=True)
+        self.keys.append(keys)
+        self.counts.append(counts)
+        self.pending += len(keys)
+        self.total += len(rows)
+        if self.pending > COMPACT_CELLS:
+            self.compact()
+
+    def compact(self):
+        """
+        Merges binned batches so every occupied cell appears once
+        """
+        if len(self.keys) > 1:
+            keys, cells = np.unique(np.concatenate(self.keys), return_inverse=True)
+            self.keys = [keys]
+            self.counts = [np.bincount(cells, weights=np.concatenate(self.counts)).astype(np.int64)]
+        self.pending = 0
+
+    def cells(self):
+        """
+        :return: tuple of (latitude, longitude, and count arrays), one element per occupied cell (at its center)
+        """
+        self.compact()
+        if not self.keys:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+        size = cell_size(self.zoom)
+        keys = self.keys[0]
+        latitudes = (keys >> self.zoom) * size - 90.0 + size / 2
+        longitudes = (keys & ((1 << self.zoom) - 1)) * size - 180.0 + size / 2
+        return latitudes, longitudes, self.counts[0]
+
+
+def box_blur(image, radius, axis):
+    """
+    Averages each pixel with its neighbors along one axis, using running sums (cost does not depend on radius)
+    :param image: 2D float array
+    :param radius: number of neighbors on each side
+    :param axis: 0 for columns, 1 for rows
+    :return: blurred 2D float array of the same shape
+    """
+    length = image.shape[axis]
+    widths = [(0, 0), (0, 0)]
+    widths[axis] = (radius + 1, radius)
+    sums = np.cumsum(np.pad(image, widths, 'constant'), axis=axis)
+    upper = [slice(None), slice(None)]
+    lower = [slice(None), slice(None)]
+    upper[axis] = slice(2 * radius + 1, None)
+    lower[axis] = slice(0, length)
+    return (sums[tuple(upper)] - sums[tuple(lower)]) / (2 * radius + 1)
+
+
+def blur(image, sigma):
+    """
+    Approximate Gaussian blur: three box blurs per axis
+    :param image: 2D float array
+    :param sigma: standard deviation in pixels
+    :return: blurred 2D float array of the same shape
+    """
+    radius = max(int(round((math.sqrt(4 * sigma ** 2 + 1) - 1) / 2)), 1)  # three boxes of 2r + 1 pixels have about
+    for axis in (0, 1):                                                      # the variance of the requested Gaussian
+        for i in xrange(3):
+            image = box_blur(image, radius, axis)
+    return image
+
+
+def colorize(density):
+    """
+    Maps density to colors on a logarithmic scale; empty pixels are fully transparent
+    :param density: 2D float array
+    :return: 3D uint8 array of RGBA pixels
+    """
+    peak = density.max()
+    scaled = np.log1p(density) / math.log1p(peak) if peak > 0 else density
+    positions = [stop[0] for stop in COLOR_STOPS]
+    rgba = np.empty(density.shape + (4,), dtype=np.uint8)
+    for channel in xrange(4):
+        rgba[..., channel] = np.interp(scaled, positions, [stop[channel + 1] for stop in COLOR_STOPS])
+    rgba[density <= peak * 1e-4, 3] = 0
+    return rgba
+
+
+def encode_png(rgba):
+    """
+    Encodes an RGBA image as PNG
+    :param rgba: 3D uint8 array of RGBA pixels (rows from top to bottom)
+    :return: PNG file contents as string
+    """
+    height, width = rgba.shape[:2]
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # each row starts with filter type 0 (none)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return ''.join([struct.pack('>I', len(data)), kind, data,
+                        struct.pack('>I', zlib.crc32(''.join([kind, data])) & 0xffffffff)])
+
+    return ''.join(['\x89PNG\r\n\x1a\n',
+                    chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+                    chunk('IDAT', zlib.compress(raw.tostring(), 6)),
+                    chunk('IEND', '')])
+
+
+def render_heatmap(grid, max_pixels=HEATMAP_PIXELS, tile_pixels=HEATMAP_TILE_PIXELS,
+                   radius_pixels=HEATMAP_RADIUS_PIXELS):
+    """
+    Draws the density of binned points as image tiles covering the points' extent
+    :param grid: DensityGrid object
+    :param max_pixels: size of the longer side of the whole image
+    :param tile_pixels: largest tile size
+    :param radius_pixels: blur radius (standard deviation) in pixels
+    :return: list of (south, west, north, east, PNG contents) tuples, one per tile that is not empty
+    """
+    latitudes, longitudes, counts = grid.cells()
+    if not len(counts):
+        return []
+
+    # pixels are square on the ground at the center of the area, and the image is padded so the blur is not cut off
+    pad = int(math.ceil(3 * radius_pixels))
+    middle = math.radians((latitudes.min() + latitudes.max()) / 2)
+    lat_span = max(latitudes.max() - latitudes.min(), MIN_SPAN)
+    lon_span = max(longitudes.max() - longitudes.min(), MIN_SPAN)
+    lat_pixel = max(lat_span, lon_span * math.cos(middle)) / max(max_pixels - 2 * pad, 1)
+    lon_pixel = lat_pixel / max(math.cos(middle), 1e-6)
+    height = int(math.ceil(lat_span / lat_pixel)) + 2 * pad
+    width = int(math.ceil(lon_span / lon_pixel)) + 2 * pad
+    south = (latitudes.min() + latitudes.max() - height * lat_pixel) / 2
+    west = (longitudes.min() + longitudes.max() - width * lon_pixel) / 2
+    north = south + height * lat_pixel
+    east = west + width * lon_pixel
+
+    density = np.histogram2d(latitudes, longitudes, bins=[height, width], range=[[south, north], [west, east]],
+                             weights=counts)[0]
+    rgba = colorize(blur(density, radius_pixels))[::-1]  # images start at the top (north)
+
+    tiles = []
+    for top in xrange(0, height, tile_pixels):
+        bottom = min(top + tile_pixels, height)
+        for left in xrange(0, width, tile_pixels):
+            right = min(left + tile_pixels, width)
+            tile = rgba[top:bottom, left:right]
+            if tile[..., 3].any():
+                tiles.append((north - bottom * lat_pixel, west + left * lon_pixel, north - top * lat_pixel,
+                              west + right * lon_pixel, encode_png(np.ascontiguousarray(tile))))
+    return tiles
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Batch job runner: maps several cases in parallel worker processes without any dialogs.
+
+Jobs are read from a JSON file containing a list of job objects, e.g.:
+
+    [{"case": {"Case Number": "15-0001", "Agency": "PD", "Agent": "Smith", "Analyst": "Jones",
+               "Target Number": "5555555555"},
+      "towers": {"file": "towers.csv", "Cell Site ID": "CellID", "Latitude": "Lat", "Longitude": "Long",
+                 "Sector": "Sector", "Azimuth": "Azimuth"},
+      "cdrs": {"file": "cdrs.csv", "Called Number": "Dialed", "Cell Site ID": "Cell", "Sector": "Sect",
+               "Other Fields": ["Date", "Time"]},
+      "report_path": "C:\\Reports"}]
+
+Use "same_file" (with "file", "Latitude", "Longitude", and "Other Fields") instead of "towers" and "cdrs" when the
+CDR and tower data are in the same CSV file. An optional "area" limits the map to a radius around a point
+({"latitude": 40.7, "longitude": -74.0, "radius_km": 5}) or to a bounding box
+({"south": 40.5, "west": -74.3, "north": 40.9, "east": -73.7}), "cluster": true groups nearby points into clusters
+when zoomed out, and "formats" lists the files to write in a single pass (any of "kml", "kmz", "geojson", "csv", and
+"heatmap", a KMZ density overlay; the default is ["kml"]). Duplicate CDRs (records repeated across overlapping
+returns) are dropped during import; add a "Duplicate Key" list of column headings to "cdrs" or "same_file" to decide
+which columns identify a record (the whole row by default, or [] to keep duplicates). "sort_by" orders the output by a
+list of fields ("CDR ID", "Latitude", "Longitude", "Called Number", "Cell Site ID", "Sector", or report fields such as
+["Date", "Time"]) with an external sort that keeps at most "sort_memory_mb" (default 64) megabytes of records in
+memory; an unknown field fails the job. Field values sort as numbers, dates (M/D/Y, M/D/YY, or Y-M-D) and times (H:MM
+or H:MM:SS, optionally with AM / PM, alone or after a date), or text, in that order. Each case is stored in its own
+database, so cases never contend for locks.
+"""
+
+import json
+import multiprocessing
+import sys
+import traceback
+from models import Database, TollsCase, SpatialFilter
+from pipeline import (initialize_database, read_headers, get_other_fields, load_two_files, load_same_file,
+                      export_report)
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+CASE_FIELDS = ['Case Number', 'Agency', 'Agent', 'Analyst', 'Target Number']
+
+
+def get_spatial_filter(area):
+    """
+    Creates spatial filter from job's "area" setting
+    :param area: dictionary with latitude, longitude, and radius_km, or with south, west, north, and east
+    :return: SpatialFilter object, or None if no area was given
+    """
+    if not area:
+        return None
+    if 'radius_km' in area:
+        return SpatialFilter.radius(area['latitude'], area['longitude'], area['radius_km'])
+    return SpatialFilter.bounding_box(area['south'], area['west'], area['north'], area['east'])
+
+
+def get_sort_options(job):
+    """
+    Gets output order from job's "sort_by" and "sort_memory_mb" settings
+    :param job: job dictionary
+    :return: dictionary of keyword arguments for export_report
+    """
+    options = {'sort_by': job.get('sort_by')}
+    if 'sort_memory_mb' in job:
+        options['sort_memory'] = int(float(job['sort_memory_mb']) * 1024 * 1024)
+    return options
+
+
+def run_job(job):
+    """
+    Maps a single case; runs inside a worker process
+    :param job: dictionary describing the case, its input files, and their columns
+    :return: tuple of (case number, list of file paths written or None, dictionary of problem description to number of
+             rows skipped because of bad coordinates or duplication, error message or None)
+    """
+    case_number = job['case']['Case Number']
+    try:
+        initialize_database(case_number)
+        tc = TollsCase(*[job['case'][field] for field in CASE_FIELDS])
+        tc.save()
+        spatial_filter = get_spatial_filter(job.get('area'))
+
+        if 'same_file' in job:
+            spec = job['same_file']
+            headers = read_headers(spec['file'])
+            i_latitude = headers.index(spec['Latitude'])
+            i_longitude = headers.index(spec['Longitude'])
+            d_other_fields = get_other_fields(headers, spec['Other Fields'], [i_latitude, i_longitude])
+            report_data, rejected = load_same_file(spec['file'], i_latitude, i_longitude, d_other_fields,
+                                                   spec.get('Duplicate Key'))
+            report_names = export_report(tc.case_unique_id, job['report_path'], report_data=report_data,
+                                         spatial_filter=spatial_filter, cluster=job.get('cluster', False),
+                                         formats=job.get('formats', ['kml']), **get_sort_options(job))
+            return case_number, report_names, rejected, None
+
+        spec = job['towers']
+        headers = read_headers(spec['file'])
+        tower_columns = (spec['file'], headers.index(spec['Cell Site ID']), headers.index(spec['Latitude']),
+                         headers.index(spec['Longitude']), headers.index(spec['Sector']),
+                         headers.index(spec['Azimuth']))
+
+        spec = job['cdrs']
+        headers = read_headers(spec['file'])
+        i_called_number = headers.index(spec['Called Number'])
+        i_cell_site_id = headers.index(spec['Cell Site ID'])
+        i_sector = headers.index(spec['Sector'])
+        d_other_fields = get_other_fields(headers, spec['Other Fields'], [i_called_number, i_cell_site_id, i_sector])
+        cdr_columns = (spec['file'], i_called_number, i_cell_site_id, i_sector, d_other_fields,
+                       spec.get('Duplicate Key'))
+
+        rejected = load_two_files(tc.case_unique_id, tower_columns, cdr_columns)
+        report_names = export_report(tc.case_unique_id, job['report_path'], spatial_filter=spatial_filter,
+                                     cluster=job.get('cluster', False), formats=job.get('formats', ['kml']),
+                                     **get_sort_options(job))
+        return case_number, report_names, rejected, None
+    except Exception:
+        return case_number, None, {}, traceback.format_exc()
+
+
+def run_jobs(jobs, processes=None):
+    """
+    Maps several cases in parallel, one worker process per core by default
+    :param jobs: list of job dictionaries (see run_job)
+    :param processes: number of worker processes, or None for one per core
+    :return: list of tuples from run_job in completion order
+    """
+    case_numbers = {}
+    for job in jobs:  # each case's database and report are named after its case number, minus problematic characters
+        case_number = job['case']['Case Number']
+        filename = Database.case_filename(case_number)
+        if filename in case_numbers:
+            raise ValueError(''.join(["Case numbers ", repr(case_numbers[filename]), " and ", repr(case_number),
+                                      " would share the same files"]))
+        case_numbers[filename] = case_number
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return list(pool.imap_unordered(run_job, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    """
+    Runs jobs listed in JSON file given on the command line
+    :param argv: command line arguments (job file path, optional number of worker processes)
+    :return: exit code
+    """
+    if len(argv) < 2:
+        sys.stderr.write("usage: jobs.py JOB_FILE [PROCESSES]\n")
+        return 2
+
+    with open(argv[1], 'rb') as f:
+        jobs = json.load(f)
+    processes = int(argv[2]) if len(argv) > 2 else None
+
+    failed = 0
+    for case_number, report_names, rejected, error in run_jobs(jobs, processes):
+        if error:
+            failed += 1
+            sys.stderr.write(''.join([case_number, ' failed:\n', error]))
+        else:
+            sys.stdout.write(''.join([case_number, ': ', ', '.join(report_names), '\n']))
+            for problem, count in sorted(rejected.iteritems()):
+                sys.stdout.write('  %d rows skipped (%s)\n' % (count, problem))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
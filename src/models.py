@@ -4,9 +4,19 @@ Data models for CDR mapping.
 """
 
 import cPickle
+import datetime
+import hashlib
+import itertools
+import math
+import numpy as np
 import os
+import re
 import sqlite3
 import string
+from clustering import build_clusters, lod_ranges
+from extsort import DEFAULT_SORT_MEMORY, external_sort
+from sitekeys import site_match_keys
+from stages import WRITE_BUFFER_SIZE, BackgroundWriter, read_ahead
 
 
 __author__ = "Dan O'Day"
@@ -17,18 +27,156 @@ __email__ = "d@4n68r.com"
 __status__ = "Prototype"
 
 
+PLACEMARK_TEMPLATE_VERSION = 3  # bump whenever render_placemark() or generate_cdata() output changes
+SQLITE_MAX_VARIABLES = 999  # most ? parameters SQLite accepts in one statement by default
+CLUSTER_LOD_PIXELS = 256  # on-screen size of a cluster's cell at which the next finer zoom level takes over
+SORT_VALUE_CACHE_SIZE = 100000  # distinct sort field values parsed once each (dates and times repeat a lot)
+SORT_DATE_TIME = re.compile(r"""^(?:(?:(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})         # year-month-day
+                                   |(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2}))      # month/day/year
+                                 (?:[T\s]+(?=\d)|$))?
+                                (?:(\d{1,2}):(\d{2})(?::(\d{2}(?:\.\d*)?))?\s*(?:([AP])\.?M?\.?)?)?$""", re.VERBOSE)
+
+def safe_filename(s):
+    """
+    Strips characters that are problematic in file names
+    :param s: string such as a case number
+    :return: string containing only letters, digits, and hyphens
+    """
+    valid_chars = "-%s%s" % (string.ascii_letters, string.digits)
+    return ''.join([c for c in s if c in valid_chars])
+
+
+class Dimension(object):
+    """
+    Lookup table for a text value that repeats across many rows (e.g. called number). Rows store the value's integer
+    key instead of the text (dictionary encoding), which keeps the database small and makes joins integer comparisons.
+    """
+    def __init__(self, table, key_column, value_column):
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+
+    def __str__(self):
+        return self.table
+
+    def __repr__(self):
+        return ''.join(('Dimension(', repr(self.table), ', ', repr(self.key_column), ', ', repr(self.value_column),
+                        ')'))
+
+    def create_table(self, cur):
+        """
+        Creates lookup table
+        :param cur: sqlite3 cursor
+        """
+        cur.execute("""
+            create table {table} (
+              {key} integer primary key not null,
+              {value} varchar not null unique
+            );""".format(table=self.table, key=self.key_column, value=self.value_column))
+
+
+CALLED_NUMBERS = Dimension('CALLED_NUMBER', 'Called_Number_Key', 'Called_Number')
+CELL_SITES = Dimension('CELL_SITE', 'Cell_Site_Key', 'Cell_Site_ID')
+SECTORS = Dimension('SECTOR', 'Sector_Key', 'Sector')
+SITE_MATCHES = Dimension('SITE_MATCH', 'Site_Match_Key', 'Site_Match')  # normalized cell site / sector pairs
+UNMATCHED_DESCRIPTION = 'No matching tower'
+AMBIGUOUS_DESCRIPTION = 'More than one matching tower'
+
+
+class DimensionEncoder(object):
+    """
+    Interns values into Dimension lookup tables using an open connection (new values are inserted without committing).
+    Keys are cached in memory, so use one encoder per transaction and only one writer per database.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.keys = {}  # table name to dictionary of value to key
+
+    def __str__(self):
+        return ''.join(('DimensionEncoder (', str(sum(len(k) for k in self.keys.itervalues())), ' values)'))
+
+    def __repr__(self):
+        return ''.join(('DimensionEncoder(', repr(self.conn), ')'))
+
+    def encode(self, dimension, values):
+        """
+        Gets keys of values, adding values not seen before to the lookup table
+        :param dimension: Dimension object
+        :param values: sequence of strings
+        :return: list of integer keys in the same order as values
+        """
+        keys = self.keys.get(dimension.table)
+        if keys is None:
+            keys = dict(self.conn.execute("select {value}, {key} from {table};".format(
+                table=dimension.table, key=dimension.key_column, value=dimension.value_column)))
+            self.keys[dimension.table] = keys
+
+        new_values = [v for v in set(values) if v not in keys]
+        if new_values:
+            first_key = self.conn.execute("select coalesce(max({key}), 0) + 1 from {table};".format(
+                table=dimension.table, key=dimension.key_column)).fetchone()[0]
+            new_keys = zip(new_values, xrange(first_key, first_key + len(new_values)))
+            self.conn.executemany("insert into {table} ({value}, {key}) values (?, ?);".format(
+                table=dimension.table, key=dimension.key_column, value=dimension.value_column), new_keys)
+            keys.update(new_keys)
+        return [keys[v] for v in values]
+
+
 class Database(object):
     """
-    Database object.
+    Database object. Each case gets its own database file (see for_case), so cases never share locks; model objects
+    use whichever database was last activated in the current process.
     """
-    def __init__(self):
-        self.database_filename = os.path.join(os.path.dirname(__file__), 'cdr_data.db')
+    active_filename = os.path.join(os.path.dirname(__file__), 'cdr_data.db')
+    cases_folder = os.path.join(os.path.dirname(__file__), 'cases')
+
+    def __init__(self, database_filename=None):
+        self.database_filename = database_filename or Database.active_filename
 
     def __str__(self):
         return self.database_filename
 
     def __repr__(self):
-        return 'Database()'
+        return ''.join(('Database(', repr(self.database_filename), ')'))
+
+    @property
+    def placemark_cache_filename(self):
+        """
+        Placemark cache lives beside the database so concurrent cases do not contend for it
+        :return: file path of placemark cache database
+        """
+        return ''.join([os.path.splitext(self.database_filename)[0], '_placemarks.db'])
+
+    @staticmethod
+    def for_case(case_number):
+        """
+        Gets database for a single case, stored in the cases folder
+        :param case_number: case number
+        :return: Database object
+        """
+        if not os.path.isdir(Database.cases_folder):
+            try:
+                os.makedirs(Database.cases_folder)
+            except OSError:  # created by another worker in the meantime
+                if not os.path.isdir(Database.cases_folder):
+                    raise
+        return Database(os.path.join(Database.cases_folder, ''.join([Database.case_filename(case_number), '.db'])))
+
+    @staticmethod
+    def case_filename(case_number):
+        """
+        Gets the name a case's files are stored under; different case numbers can share one (e.g. "15 0001" and
+        "150001"), so cases run at the same time must be checked with this rather than by case number
+        :param case_number: case number
+        :return: case number without characters that are problematic in file names ('case' if none are left)
+        """
+        return safe_filename(case_number) or 'case'
+
+    def activate(self):
+        """
+        Makes this the database used by TollsCase, Tower, CDR, and Report in the current process
+        """
+        Database.active_filename = self.database_filename
 
     def create_tables(self):
         """
@@ -48,17 +196,34 @@ class Database(object):
             );
         """)
 
+        # called numbers, cell site IDs, and sectors are stored once in lookup tables; TOWER and CDR store their keys
+        for dimension in (CALLED_NUMBERS, CELL_SITES, SECTORS, SITE_MATCHES):
+            dimension.create_table(cur)
+
         conn.commit()
 
         cur.execute("""
             create table TOWER (
               Tower_ID integer primary key autoincrement not null,
               Tower_Case_ID integer not null,
-              Tower_Cell_Site_ID varchar not null,
-              Tower_Latitude varchar not null,
-              Tower_Longitude varchar not null,
-              Tower_Sector varchar not null,
-              Tower_Azimuth integer not null
+              Tower_Cell_Site_Key integer not null,
+              Tower_Latitude real not null,
+              Tower_Longitude real not null,
+              Tower_Sector_Key integer not null,
+              Tower_Azimuth integer not null,
+              Tower_Site_Match_Key integer not null
+            );
+        """)
+
+        # CDRs are linked to towers by normalized cell site / sector (see sitekeys.py) rather than the text as given
+        cur.execute("create index TOWER_SITE_MATCH on TOWER (Tower_Case_ID, Tower_Site_Match_Key);")
+
+        # spatial index over tower locations (R*Tree stores 32-bit floats, so results are refined against TOWER)
+        cur.execute("""
+            create virtual table TOWER_LOCATION using rtree (
+              Tower_ID,
+              Min_Latitude, Max_Latitude,
+              Min_Longitude, Max_Longitude
             );
         """)
 
@@ -68,13 +233,19 @@ class Database(object):
             create table CDR (
               CDR_ID integer primary key autoincrement not null,
               CDR_Case_ID integer not null,
-              CDR_Called_Number varchar not null,
-              CDR_Cell_Site_ID varchar not null,
-              CDR_Sector varchar not null,
-              CDR_Other blob null
+              CDR_Called_Number_Key integer not null,
+              CDR_Cell_Site_Key integer not null,
+              CDR_Sector_Key integer not null,
+              CDR_Other blob null,
+              CDR_Site_Match_Key integer not null,
+              CDR_Tower_ID integer null
             );
         """)
 
+        # CDR_Tower_ID is filled in by CDR.match_towers() once a case's towers and CDRs are all inserted
+        cur.execute("create index CDR_SITE_MATCH on CDR (CDR_Case_ID, CDR_Site_Match_Key);")
+        cur.execute("create index CDR_TOWER on CDR (CDR_Case_ID, CDR_Tower_ID);")
+
         conn.commit()
         conn.close()
 
@@ -136,6 +307,18 @@ class TollsCase(object):
         conn.close()
         return case_number
 
+    @staticmethod
+    def get_latest_case_id():
+        """
+        Gets primary key of the most recently saved TollsCase record (each case database normally holds one)
+        :return: primary key, or None if no case has been saved
+        """
+        db = Database()
+        conn = sqlite3.connect(db.database_filename)
+        case_id = conn.execute("select max(Case_ID) from TOLLS_CASE").fetchone()[0]
+        conn.close()
+        return case_id
+
     @staticmethod
     def get_case_details(pk):
         """
@@ -163,8 +346,10 @@ class TollsCase(object):
 
 class Tower(object):
     """
-    Cell site / tower object.
+    Cell site / tower object. Bulk imports use TowerBatch instead of one object per row.
     """
+    __slots__ = ('case_id', 'cell_site_id', 'latitude', 'longitude', 'sector', 'azimuth')
+
     def __init__(self, tolls_case_id, cell_site_id, latitude, longitude, sector, azimuth):
         self.case_id = int(tolls_case_id)  # TollsCase object case_unique_id property
         self.cell_site_id = cell_site_id
@@ -191,34 +376,98 @@ class Tower(object):
         db = Database()
         conn = sqlite3.connect(db.database_filename)
         conn.text_factory = str
-        cur = conn.execute("""
-            insert into TOWER (Tower_Case_ID, Tower_Cell_Site_ID, Tower_Latitude, Tower_Longitude, Tower_Sector,
-            Tower_Azimuth) values (?, ?, ?, ?, ?, ?);""", (self.case_id, self.cell_site_id, self.latitude,
-                                                           self.longitude, self.sector, self.azimuth))
+        self.insert(conn)
         conn.commit()
         conn.close()
 
+    def insert(self, conn, encoder=None):
+        """
+        Inserts Tower object using an open connection, without committing
+        :param conn: sqlite3 connection to case database
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        last_id = Tower.get_last_id(conn)
+        Tower.insert_rows(conn, [self.row()], encoder)
+        Tower.index_locations(conn, last_id)
+        CDR.match_towers(conn, self.case_id)
+
+    def row(self):
+        """
+        :return: tuple of column values as inserted by insert_rows(), ending with the normalized cell site / sector
+        """
+        return (self.case_id, self.cell_site_id, float(self.latitude), float(self.longitude), self.sector, self.azimuth,
+                site_match_keys([self.cell_site_id], [self.sector])[0])
+
+    @staticmethod
+    def insert_rows(conn, rows, encoder=None):
+        """
+        Inserts many towers at once using an open connection, without committing (for bulk imports). Call
+        index_locations() once all towers are inserted, then CDR.match_towers() once the case's CDRs are too.
+        :param conn: sqlite3 connection to case database
+        :param rows: list of tuples from Tower.row()
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        if not rows:
+            return
+        encoder = encoder or DimensionEncoder(conn)
+        case_ids, cell_site_ids, latitudes, longitudes, sectors, azimuths, site_matches = zip(*rows)
+        conn.executemany("""
+            insert into TOWER (Tower_Case_ID, Tower_Cell_Site_Key, Tower_Latitude, Tower_Longitude, Tower_Sector_Key,
+            Tower_Azimuth, Tower_Site_Match_Key) values (?, ?, ?, ?, ?, ?, ?);""",
+                         zip(case_ids, encoder.encode(CELL_SITES, cell_site_ids), latitudes, longitudes,
+                             encoder.encode(SECTORS, sectors), azimuths, encoder.encode(SITE_MATCHES, site_matches)))
+
+    @staticmethod
+    def get_last_id(conn):
+        """
+        :param conn: sqlite3 connection to case database
+        :return: highest Tower_ID so far (0 if there are no towers)
+        """
+        return conn.execute("select coalesce(max(Tower_ID), 0) from TOWER;").fetchone()[0]
+
+    @staticmethod
+    def index_locations(conn, after_id):
+        """
+        Adds towers inserted since after_id to the spatial index in one statement (much faster than indexing each
+        batch as it arrives)
+        :param conn: sqlite3 connection to case database
+        :param after_id: value of get_last_id() before the towers were inserted
+        """
+        conn.execute("""
+            insert into TOWER_LOCATION (Tower_ID, Min_Latitude, Max_Latitude, Min_Longitude, Max_Longitude)
+            select Tower_ID, Tower_Latitude, Tower_Latitude, Tower_Longitude, Tower_Longitude
+            from TOWER
+            where Tower_ID > ?;""", (after_id,))
+
     @staticmethod
     def get_tower_location(case_id, cell_site_id, sector):
         """
-        Gets location of cell site (tower) given necessary CDR data.
+        Gets location of cell site (tower) given necessary CDR data: the tower that the case's CDRs with this cell
+        site and sector were matched to on import (see CDR.match_towers), so e.g. sector "001" matches sector "1".
         :param case_id: Primary key of TollsCase object (case_unique_id)
         :param cell_site_id: Cell site / tower identifier
         :param sector: Sector of cell site / tower connected to
-        :return: Dictionary containing latitude, longitude of tower and azimuth of tower sector connected to
+        :return: Dictionary containing latitude, longitude of tower and azimuth of tower sector connected to, or None
+                 if no tower (or more than one) matches
         """
         db = Database()
         conn = sqlite3.connect(db.database_filename)
         conn.text_factory = str
         conn.row_factory = sqlite3.Row
         cur = conn.execute("""
-            select Tower_Latitude, Tower_Longitude, Tower_Azimuth
-            from TOWER
-            where Tower_Case_ID=?
-              and Tower_Cell_Site_ID=?
-              and Tower_Sector=?;""", (case_id, cell_site_id, sector))
+            select TOWER.Tower_Latitude, TOWER.Tower_Longitude, TOWER.Tower_Azimuth
+            from CDR
+              join CELL_SITE on CELL_SITE.Cell_Site_Key = CDR.CDR_Cell_Site_Key
+              join SECTOR on SECTOR.Sector_Key = CDR.CDR_Sector_Key
+              join TOWER on TOWER.Tower_ID = CDR.CDR_Tower_ID
+            where CDR.CDR_Case_ID=?
+              and CELL_SITE.Cell_Site_ID=?
+              and SECTOR.Sector=?
+            limit 1;""", (case_id, cell_site_id, sector))
         record = cur.fetchone()
         conn.close()
+        if record is None:
+            return None
         return {
             'Latitude': record['Tower_Latitude'],
             'Longitude': record['Tower_Longitude'],
@@ -226,10 +475,178 @@ class Tower(object):
         }
 
 
+class TowerBatch(object):
+    """
+    Column-oriented batch of towers for bulk imports: one list (or float array) per column rather than one Tower object
+    per row.
+    """
+    model = Tower
+
+    def __init__(self, tolls_case_id, cell_site_ids, latitudes, longitudes, sectors, azimuths, hex_cell_sites=None):
+        self.case_id = int(tolls_case_id)
+        self.cell_site_ids = cell_site_ids
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.sectors = sectors
+        self.azimuths = azimuths
+        self.hex_cell_sites = hex_cell_sites  # decided for the whole file column (see sitekeys.is_hex_column)
+
+    def __len__(self):
+        return len(self.cell_site_ids)
+
+    def __str__(self):
+        return ''.join(('TowerBatch (', str(len(self)), ' towers)'))
+
+    def __repr__(self):
+        return ''.join(('TowerBatch(', repr(self.case_id), ', ', repr(len(self)), ')'))
+
+    def rows(self):
+        """
+        :return: list of tuples of column values as inserted by Tower.insert_rows()
+        """
+        return zip([self.case_id] * len(self), self.cell_site_ids, self.latitudes.tolist(), self.longitudes.tolist(),
+                   self.sectors, self.azimuths, site_match_keys(self.cell_site_ids, self.sectors, self.hex_cell_sites))
+
+    def insert(self, conn, encoder=None):
+        """
+        Inserts all towers in batch using an open connection, without committing. Call Tower.index_locations() once
+        all batches are inserted, then CDR.match_towers().
+        :param conn: sqlite3 connection to case database
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        Tower.insert_rows(conn, self.rows(), encoder)
+
+
+class SpatialFilter(object):
+    """
+    Geographic area used to limit a report, either a bounding box or a radius around a point.
+    """
+    KM_PER_DEGREE = 111.32  # length of one degree of latitude (and of longitude at the equator)
+    EARTH_RADIUS_KM = 6371.0
+
+    def __init__(self, south, west, north, east, center=None, radius_km=None):
+        self.south = float(south)
+        self.west = float(west)
+        self.north = float(north)
+        self.east = float(east)
+        self.center = center  # (latitude, longitude) tuple for radius filters
+        self.radius_km = radius_km
+
+    def __str__(self):
+        if self.radius_km is not None:
+            return ''.join(('Within ', str(self.radius_km), ' km of ', str(self.center)))
+        return ''.join(('Within (', str(self.south), ', ', str(self.west), ') - (', str(self.north), ', ',
+                        str(self.east), ')'))
+
+    def __repr__(self):
+        return ''.join(('SpatialFilter(',
+                        repr(self.south), ', ',
+                        repr(self.west), ', ',
+                        repr(self.north), ', ',
+                        repr(self.east), ', ',
+                        repr(self.center), ', ',
+                        repr(self.radius_km), ')'))
+
+    @staticmethod
+    def bounding_box(south, west, north, east):
+        """
+        Creates filter for a bounding box such as the current viewport (boxes crossing 180 degrees are not supported)
+        :return: SpatialFilter object
+        """
+        return SpatialFilter(south, west, north, east)
+
+    @staticmethod
+    def radius(latitude, longitude, radius_km):
+        """
+        Creates filter for all locations within a distance of a point (e.g. a scene)
+        :param latitude: latitude of point in decimal degrees
+        :param longitude: longitude of point in decimal degrees
+        :param radius_km: distance in kilometers
+        :return: SpatialFilter object
+        """
+        latitude = float(latitude)
+        longitude = float(longitude)
+        radius_km = float(radius_km)
+        d_lat = radius_km / SpatialFilter.KM_PER_DEGREE
+        d_lon = radius_km / max(SpatialFilter.KM_PER_DEGREE * math.cos(math.radians(latitude)), 1e-6)
+        return SpatialFilter(max(latitude - d_lat, -90.0), max(longitude - d_lon, -180.0),
+                             min(latitude + d_lat, 90.0), min(longitude + d_lon, 180.0),
+                             center=(latitude, longitude), radius_km=radius_km)
+
+    @staticmethod
+    def distance_km(lat1, lon1, lat2, lon2):
+        """
+        Great-circle (haversine) distance between two points
+        :return: distance in kilometers
+        """
+        lat1, lon1, lat2, lon2 = [math.radians(float(v)) for v in (lat1, lon1, lat2, lon2)]
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * SpatialFilter.EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+    def contains(self, latitude, longitude):
+        """
+        Checks whether a location is inside the filter area
+        :param latitude: latitude in decimal degrees
+        :param longitude: longitude in decimal degrees
+        :return: True if inside, False otherwise
+        """
+        latitude = float(latitude)
+        longitude = float(longitude)
+        if not (self.south <= latitude <= self.north and self.west <= longitude <= self.east):
+            return False
+        if self.radius_km is not None:
+            return self.distance_km(self.center[0], self.center[1], latitude, longitude) <= self.radius_km
+        return True
+
+    def contains_many(self, latitudes, longitudes):
+        """
+        Checks a whole batch of locations at once (see contains)
+        :param latitudes: float array of latitudes in decimal degrees
+        :param longitudes: float array of longitudes in decimal degrees
+        :return: boolean array, True where inside
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        inside = ((latitudes >= self.south) & (latitudes <= self.north) &
+                  (longitudes >= self.west) & (longitudes <= self.east))
+        if self.radius_km is not None:
+            lat1, lon1 = np.radians(self.center[0]), np.radians(self.center[1])
+            lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+            a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+            distance = 2 * SpatialFilter.EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+            inside &= distance <= self.radius_km
+        return inside
+
+
 class CDR(object):
     """
-    Call Detail Record (CDR) object
+    Call Detail Record (CDR) object. Bulk imports use CDRBatch instead of one object per row.
     """
+    __slots__ = ('case_id', 'called_number', 'cell_site_id', 'sector', 'other_fields', 'cdr_unique_id')
+
+    INSERT_SQL = """
+        insert into CDR (CDR_Case_ID, CDR_Called_Number_Key, CDR_Cell_Site_Key, CDR_Sector_Key, CDR_Other,
+        CDR_Site_Match_Key) values (?, ?, ?, ?, ?, ?);"""
+
+    # CDRs with location data (a cell site / tower ID is given)
+    LOCATED_SQL = """
+                  and CDR.CDR_Cell_Site_Key not in (select Cell_Site_Key
+                                                    from CELL_SITE
+                                                    where Cell_Site_ID in ('', 'NA'))"""
+
+    # CDRs matched to the towers the R*Tree finds in an area; cross join keeps SQLite from reordering the tables, so
+    # the query starts from the spatial index (parameters: south, north, west, east, case ID)
+    AREA_SQL = """
+                from TOWER_LOCATION
+                  cross join TOWER on TOWER.Tower_ID = TOWER_LOCATION.Tower_ID
+                  cross join CDR on CDR.CDR_Case_ID = TOWER.Tower_Case_ID
+                          and CDR.CDR_Tower_ID = TOWER.Tower_ID{lookups}
+                where TOWER_LOCATION.Max_Latitude >= ?
+                  and TOWER_LOCATION.Min_Latitude <= ?
+                  and TOWER_LOCATION.Max_Longitude >= ?
+                  and TOWER_LOCATION.Min_Longitude <= ?
+                  and TOWER.Tower_Case_ID=?"""
+
     def __init__(self, tolls_case_id, called_number, cell_site_id, sector, other_fields):
         self.case_id = int(tolls_case_id)  # TollsCase object case_unique_id property
         self.called_number = called_number
@@ -259,14 +676,56 @@ class CDR(object):
         db = Database()
         conn = sqlite3.connect(db.database_filename)
         conn.text_factory = str
-        cur = conn.execute("""
-            insert into CDR (CDR_Case_ID, CDR_Called_Number, CDR_Cell_Site_ID, CDR_Sector, CDR_Other) values
-            (?, ?, ?, ?, ?);""", (self.case_id, self.called_number, self.cell_site_id, self.sector,
-                                  sqlite3.Binary(cPickle.dumps(self.other_fields, cPickle.HIGHEST_PROTOCOL))))
+        self.insert(conn)
         conn.commit()
-        self.cdr_unique_id = int(cur.lastrowid)  # set unique cdr id to primary key int value from db
         conn.close()
 
+    def insert(self, conn, encoder=None):
+        """
+        Inserts CDR object using an open connection, without committing
+        :param conn: sqlite3 connection to case database
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        cur = conn.execute(CDR.INSERT_SQL, CDR.encode_rows([self.row()], encoder or DimensionEncoder(conn))[0])
+        self.cdr_unique_id = int(cur.lastrowid)  # set unique cdr id to primary key int value from db
+        CDR.match_towers(conn, self.case_id)
+
+    def row(self):
+        """
+        :return: tuple of column values as inserted by insert_rows(), ending with the normalized cell site / sector
+                 (other fields are pickled, but not yet wrapped in sqlite3.Binary so rows can be passed between
+                 processes)
+        """
+        return (self.case_id, self.called_number, self.cell_site_id, self.sector,
+                cPickle.dumps(self.other_fields, cPickle.HIGHEST_PROTOCOL),
+                site_match_keys([self.cell_site_id], [self.sector])[0])
+
+    @staticmethod
+    def insert_rows(conn, rows, encoder=None):
+        """
+        Inserts many CDRs at once using an open connection, without committing (for bulk imports). Call match_towers()
+        once all of the case's towers and CDRs are inserted.
+        :param conn: sqlite3 connection to case database
+        :param rows: list of tuples from CDR.row()
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        if rows:
+            conn.executemany(CDR.INSERT_SQL, CDR.encode_rows(rows, encoder or DimensionEncoder(conn)))
+
+    @staticmethod
+    def encode_rows(rows, encoder):
+        """
+        Replaces called numbers, cell site IDs, sectors, and normalized cell site / sector pairs with their lookup
+        table keys
+        :param rows: non-empty list of tuples from CDR.row()
+        :param encoder: DimensionEncoder
+        :return: list of tuples of column values for CDR.INSERT_SQL
+        """
+        case_ids, called_numbers, cell_site_ids, sectors, other, site_matches = zip(*rows)
+        return zip(case_ids, encoder.encode(CALLED_NUMBERS, called_numbers), encoder.encode(CELL_SITES, cell_site_ids),
+                   encoder.encode(SECTORS, sectors), [sqlite3.Binary(o) for o in other],
+                   encoder.encode(SITE_MATCHES, site_matches))
+
     @staticmethod
     def get_cdr_details(pk, case_id):
         """
@@ -280,42 +739,158 @@ class CDR(object):
         conn.text_factory = str
         conn.row_factory = sqlite3.Row
 
-        cur = conn.execute("select * from CDR where CDR_ID=? and CDR_Case_ID=?", (pk, case_id))
+        cur = conn.execute("""
+            select CDR.CDR_Case_ID, CALLED_NUMBER.Called_Number, CELL_SITE.Cell_Site_ID, SECTOR.Sector, CDR.CDR_Other
+            from CDR
+              join CALLED_NUMBER on CALLED_NUMBER.Called_Number_Key = CDR.CDR_Called_Number_Key
+              join CELL_SITE on CELL_SITE.Cell_Site_Key = CDR.CDR_Cell_Site_Key
+              join SECTOR on SECTOR.Sector_Key = CDR.CDR_Sector_Key
+            where CDR.CDR_ID=?
+              and CDR.CDR_Case_ID=?;""", (pk, case_id))
         record = cur.fetchone()
 
         conn.close()
         return {
             'Case ID': record['CDR_Case_ID'],
-            'Called Number': record['CDR_Called_Number'],
-            'Cell Site ID': record['CDR_Cell_Site_ID'],
-            'Sector': record['CDR_Sector'],
+            'Called Number': record['Called_Number'],
+            'Cell Site ID': record['Cell_Site_ID'],
+            'Sector': record['Sector'],
             'Other Fields': dict(cPickle.loads(str(record['CDR_Other'])))
         }
 
     @staticmethod
-    def get_cdrs_with_location_data(case_id):
+    def get_located_batches(case_id, spatial_filter=None, batch_size=5000, details=False):
         """
-        Gets primary keys of CDRs with location data (i.e. they have a specified cell site / tower ID)
+        Resolves CDRs with location data to their towers' locations in a single query (rather than two lookups per
+        CDR), a batch at a time, using the towers they were matched to on import. CDRs without exactly one matching
+        tower are left out (see match_towers).
         :param case_id: TollsCase primary key
-        :return: list of primary keys of CDR records with location data
+        :param spatial_filter: SpatialFilter limiting CDRs to towers in an area, or None for all CDRs
+        :param batch_size: maximum number of points per batch
+        :param details: True to include each CDR's called number, cell site ID, and sector in the batches
+        :return: generator of LocatedCDRBatch objects in CDR order
         """
         db = Database()
         conn = sqlite3.connect(db.database_filename)
         conn.text_factory = str
-        conn.row_factory = sqlite3.Row
 
-        cur = conn.execute("""
-            select CDR_ID
-            from CDR
-            where CDR_Case_ID=?
-              and CDR_Cell_Site_ID != ''
-              and CDR_Cell_Site_ID != 'NA'
-              and CDR_Cell_Site_ID is not null
-            order by CDR_ID;""", (case_id,))
-        records = cur.fetchall()
-        conn.close()
+        detail_columns = ''
+        lookups = ''
+        if details:  # looked up after CDR in the join order, so the lookup tables never drive the query
+            detail_columns = ', CALLED_NUMBER.Called_Number, CELL_SITE.Cell_Site_ID, SECTOR.Sector'
+            lookups = """
+                  cross join CALLED_NUMBER on CALLED_NUMBER.Called_Number_Key = CDR.CDR_Called_Number_Key
+                  cross join CELL_SITE on CELL_SITE.Cell_Site_Key = CDR.CDR_Cell_Site_Key
+                  cross join SECTOR on SECTOR.Sector_Key = CDR.CDR_Sector_Key"""
+        if spatial_filter:
+            # only the CDRs of towers in the area are read; exact bounds / distance are checked against each batch
+            query = ''.join(["""
+                select CDR.CDR_ID, TOWER.Tower_Latitude, TOWER.Tower_Longitude, CDR.CDR_Other{detail_columns}""",
+                             CDR.AREA_SQL, """
+                order by CDR.CDR_ID;"""])
+            parameters = (spatial_filter.south, spatial_filter.north, spatial_filter.west, spatial_filter.east,
+                          case_id)
+        else:
+            # CDRs are read in rowid order; through CDR_TOWER SQLite would sort every row in a temp B-tree first
+            query = """
+                select CDR.CDR_ID, TOWER.Tower_Latitude, TOWER.Tower_Longitude, CDR.CDR_Other{detail_columns}
+                from CDR not indexed
+                  cross join TOWER on TOWER.Tower_ID = CDR.CDR_Tower_ID{lookups}
+                where CDR.CDR_Case_ID=?
+                order by CDR.CDR_ID;"""
+            parameters = (case_id,)
+
+        try:
+            query = query.format(detail_columns=detail_columns, lookups=lookups)
+            cur = conn.execute(query, parameters)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                columns = zip(*rows)
+                cdr_ids, latitudes, longitudes, other = columns[:4]
+                batch = LocatedCDRBatch(list(cdr_ids), latitudes, longitudes,
+                                        [dict(cPickle.loads(str(o))) for o in other], *[list(c) for c in columns[4:]])
+                if spatial_filter:
+                    batch = batch.select(spatial_filter.contains_many(batch.latitudes, batch.longitudes))
+                yield batch
+        finally:
+            conn.close()
+
+    @staticmethod
+    def count_by_tower(case_id, spatial_filter):
+        """
+        Counts the CDRs at each tower in an area without reading the CDRs themselves (e.g. to draw clusters)
+        :param case_id: TollsCase primary key
+        :param spatial_filter: SpatialFilter giving the area
+        :return: tuple of (latitude, longitude, and count arrays), one element per tower with CDRs
+        """
+        query = ''.join(["""
+                select TOWER.Tower_Latitude, TOWER.Tower_Longitude, count(*)""", CDR.AREA_SQL.format(lookups=''), """
+                group by TOWER.Tower_ID;"""])
+        parameters = (spatial_filter.south, spatial_filter.north, spatial_filter.west, spatial_filter.east, case_id)
+        db = Database()
+        conn = sqlite3.connect(db.database_filename)
+        try:
+            rows = conn.execute(query, parameters).fetchall()
+        finally:
+            conn.close()
 
-        return [row[0] for row in records]
+        latitudes = np.array([row[0] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[1] for row in rows], dtype=np.float64)
+        counts = np.array([row[2] for row in rows], dtype=np.int64)
+        inside = spatial_filter.contains_many(latitudes, longitudes)  # the R*Tree stores 32-bit floats
+        return latitudes[inside], longitudes[inside], counts[inside]
+
+    @staticmethod
+    def match_towers(conn, case_id):
+        """
+        Links each of a case's CDRs with location data to its tower, replacing any earlier matches (run once the case's
+        towers and CDRs are inserted). A tower whose cell site and sector are written exactly as in the CDR is used if
+        there is one; otherwise towers are matched on the normalized cell site / sector (see sitekeys.py). Towers at the
+        same location are the same tower, but a CDR matching towers at more than one location is left unmatched rather
+        than placed at an arbitrary one. Each distinct cell site / sector is resolved once, not once per CDR.
+        :param conn: sqlite3 connection to case database
+        :param case_id: TollsCase primary key
+        :return: dictionary of problem description to number of CDRs left off the map because no tower, or more than
+                 one, matches their cell site / sector (empty if every CDR has a tower)
+        """
+        exact = {}  # (cell site key, sector key) to dictionary of location to first tower there
+        normalized = {}  # site match key to dictionary of location to first tower there
+        for tower_id, cell_site_key, sector_key, site_match_key, latitude, longitude in conn.execute("""
+                select Tower_ID, Tower_Cell_Site_Key, Tower_Sector_Key, Tower_Site_Match_Key, Tower_Latitude,
+                       Tower_Longitude
+                from TOWER
+                where Tower_Case_ID=?
+                order by Tower_ID;""", (case_id,)):
+            exact.setdefault((cell_site_key, sector_key), {}).setdefault((latitude, longitude), tower_id)
+            normalized.setdefault(site_match_key, {}).setdefault((latitude, longitude), tower_id)
+
+        problems = {}
+        matches = []
+        for cell_site_key, sector_key, site_match_key, count in conn.execute("""
+                select CDR.CDR_Cell_Site_Key, CDR.CDR_Sector_Key, CDR.CDR_Site_Match_Key, count(*)
+                from CDR
+                where CDR.CDR_Case_ID=?{located}
+                group by CDR.CDR_Site_Match_Key, CDR.CDR_Cell_Site_Key, CDR.CDR_Sector_Key;""".format(
+                    located=CDR.LOCATED_SQL), (case_id,)).fetchall():
+            towers = exact.get((cell_site_key, sector_key)) or normalized.get(site_match_key, {})
+            tower_id = None
+            if len(towers) == 1:
+                tower_id = next(towers.itervalues())
+            else:
+                problem = AMBIGUOUS_DESCRIPTION if towers else UNMATCHED_DESCRIPTION
+                problems[problem] = problems.get(problem, 0) + count
+            matches.append((tower_id, case_id, site_match_key, cell_site_key, sector_key))
+
+        conn.executemany("""
+            update CDR
+            set CDR_Tower_ID=?
+            where CDR_Case_ID=?
+              and CDR_Site_Match_Key=?
+              and CDR_Cell_Site_Key=?
+              and CDR_Sector_Key=?;""", matches)
+        return problems
 
     @staticmethod
     def generate_cdata(pk, case_id, latitude=None, longitude=None, other_fields=None):
@@ -323,13 +898,18 @@ class CDR(object):
         Generates CDATA (XML Character Data) that pops up in description of points on the map
         :param pk: primary key of CDR record
         :param case_id: primary key of TollsCase object (case_unique_id)
+        :param latitude: latitude already resolved for this record, or None to look it up
+        :param longitude: longitude already resolved for this record, or None to look it up
+        :param other_fields: report fields already resolved for this record (may be empty), or None to look them up
         :return: CDATA as string (including header and footer CDATA tags)
         """
         cdata_header = "<![CDATA[ <table border='0' cellspacing='0' cellpadding='0'>"
 
-        if not latitude or not longitude or not other_fields:
+        if latitude is None or longitude is None or other_fields is None:
             cdr_details = CDR.get_cdr_details(pk, case_id)
             tower_details = Tower.get_tower_location(case_id, cdr_details['Cell Site ID'], cdr_details['Sector'])
+            if tower_details is None:  # no tower matches, so the location is left blank
+                tower_details = {'Latitude': '', 'Longitude': '', 'Azimuth': ''}
             other_fields = cdr_details['Other Fields']
 
             cdata_fixed = """
@@ -451,15 +1031,272 @@ class CDR(object):
         return ''.join([cdata_header, cdata_fixed, cdata_addtl, cdata_footer])
 
 
+class CDRBatch(object):
+    """
+    Column-oriented batch of CDRs for bulk imports: one list per column rather than one CDR object per row.
+    """
+    model = CDR
+
+    def __init__(self, tolls_case_id, called_numbers, cell_site_ids, sectors, other_names, other_columns,
+                 hex_cell_sites=None):
+        self.case_id = int(tolls_case_id)
+        self.called_numbers = called_numbers
+        self.cell_site_ids = cell_site_ids
+        self.sectors = sectors
+        self.other_names = other_names  # report field names
+        self.other_columns = other_columns  # one list of values per report field, in the same order as other_names
+        self.hex_cell_sites = hex_cell_sites  # decided for the whole file column (see sitekeys.is_hex_column)
+
+    def __len__(self):
+        return len(self.cell_site_ids)
+
+    def __str__(self):
+        return ''.join(('CDRBatch (', str(len(self)), ' CDRs)'))
+
+    def __repr__(self):
+        return ''.join(('CDRBatch(', repr(self.case_id), ', ', repr(len(self)), ')'))
+
+    def rows(self):
+        """
+        :return: list of tuples of column values as inserted by CDR.insert_rows()
+        """
+        dumps = cPickle.dumps
+        names = self.other_names
+        other = [dumps(dict(zip(names, values)), cPickle.HIGHEST_PROTOCOL)
+                 for values in zip(*self.other_columns)] if names else [dumps({}, cPickle.HIGHEST_PROTOCOL)] * len(self)
+        return zip([self.case_id] * len(self), self.called_numbers, self.cell_site_ids, self.sectors, other,
+                   site_match_keys(self.cell_site_ids, self.sectors, self.hex_cell_sites))
+
+    def insert(self, conn, encoder=None):
+        """
+        Inserts all CDRs in batch using an open connection, without committing. Call CDR.match_towers() once all
+        batches are inserted.
+        :param conn: sqlite3 connection to case database
+        :param encoder: DimensionEncoder for conn, or None to create one
+        """
+        CDR.insert_rows(conn, self.rows(), encoder)
+
+
+class LocatedCDRBatch(object):
+    """
+    Batch of map points (CDRs resolved to a location), stored as parallel columns so that whole batches can be
+    filtered, clustered, and rendered at once. Called numbers, cell site IDs, and sectors are only carried when they
+    were asked for (e.g. to sort by them); otherwise they are None.
+    """
+    def __init__(self, cdr_ids, latitudes, longitudes, other_fields, called_numbers=None, cell_site_ids=None,
+                 sectors=None):
+        self.cdr_ids = cdr_ids
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.other_fields = other_fields  # dictionary of report fields per point
+        self.called_numbers = called_numbers
+        self.cell_site_ids = cell_site_ids
+        self.sectors = sectors
+
+    def __len__(self):
+        return len(self.cdr_ids)
+
+    def __str__(self):
+        return ''.join(('LocatedCDRBatch (', str(len(self)), ' points)'))
+
+    def __repr__(self):
+        return ''.join(('LocatedCDRBatch(', repr(len(self)), ')'))
+
+    def has_details(self):
+        """
+        :return: True if the batch carries called numbers, cell site IDs, and sectors
+        """
+        return self.called_numbers is not None
+
+    def records(self):
+        """
+        :return: list of (cdr id, latitude, longitude, other fields) tuples
+        """
+        return zip(self.cdr_ids, self.latitudes.tolist(), self.longitudes.tolist(), self.other_fields)
+
+    def detailed_records(self):
+        """
+        :return: list of (cdr id, latitude, longitude, other fields, called number, cell site ID, sector) tuples (the
+                 last three are None if the batch does not carry them)
+        """
+        if not self.has_details():
+            return [record + (None, None, None) for record in self.records()]
+        return zip(self.cdr_ids, self.latitudes.tolist(), self.longitudes.tolist(), self.other_fields,
+                   self.called_numbers, self.cell_site_ids, self.sectors)
+
+    @staticmethod
+    def from_records(records):
+        """
+        Creates batch from records
+        :param records: non-empty list of tuples from records() or detailed_records()
+        :return: LocatedCDRBatch object
+        """
+        columns = [list(column) for column in zip(*records)]
+        if len(columns) > 4 and columns[4][0] is None:  # detailed records of a batch without details
+            columns = columns[:4]
+        return LocatedCDRBatch(*columns)
+
+    def select(self, mask):
+        """
+        Selects points from batch
+        :param mask: boolean array (or array of indexes) of points to keep
+        :return: LocatedCDRBatch object
+        """
+        indexes = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else mask
+        details = [None, None, None]
+        if self.has_details():
+            details = [[column[i] for i in indexes] for column in (self.called_numbers, self.cell_site_ids,
+                                                                   self.sectors)]
+        return LocatedCDRBatch([self.cdr_ids[i] for i in indexes], self.latitudes[indexes],
+                               self.longitudes[indexes], [self.other_fields[i] for i in indexes], *details)
+
+    @staticmethod
+    def concatenate(batches):
+        """
+        Joins batches into one (details are kept only if every batch has them)
+        :param batches: iterable of LocatedCDRBatch objects
+        :return: LocatedCDRBatch object
+        """
+        batches = list(batches)
+        cdr_ids = []
+        other_fields = []
+        for batch in batches:
+            cdr_ids.extend(batch.cdr_ids)
+            other_fields.extend(batch.other_fields)
+        details = [None, None, None]
+        if batches and all(batch.has_details() for batch in batches):
+            details = [[], [], []]
+            for batch in batches:
+                for column, values in zip(details, (batch.called_numbers, batch.cell_site_ids, batch.sectors)):
+                    column.extend(values)
+        return LocatedCDRBatch(cdr_ids, np.concatenate([b.latitudes for b in batches] or [[]]),
+                               np.concatenate([b.longitudes for b in batches] or [[]]), other_fields, *details)
+
+
+class PlacemarkCache(object):
+    """
+    Content-addressed cache of rendered placemark fragments, kept outside of the case database so that it survives
+    between runs. Least recently used fragments are evicted once the cache grows past max_bytes.
+    """
+    def __init__(self, cache_filename=None, max_bytes=64 * 1024 * 1024):
+        if not cache_filename:
+            cache_filename = os.path.join(os.path.dirname(__file__), 'placemark_cache.db')
+        self.cache_filename = cache_filename
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+
+    def __str__(self):
+        return self.cache_filename
+
+    def __repr__(self):
+        return ''.join(('PlacemarkCache(', repr(self.cache_filename), ', ', repr(self.max_bytes), ')'))
+
+    def open(self):
+        """
+        Opens (creating if needed) the cache database and starts a new generation for LRU bookkeeping
+        """
+        self.conn = sqlite3.connect(self.cache_filename)
+        self.conn.text_factory = str
+        self.conn.execute("""
+            create table if not exists FRAGMENT (
+              Fragment_Key varchar primary key not null,
+              Fragment_Data blob not null,
+              Fragment_Size integer not null,
+              Fragment_Last_Used integer not null
+            );""")
+        self.conn.execute("create index if not exists FRAGMENT_LAST_USED on FRAGMENT (Fragment_Last_Used);")
+        self.generation = (self.conn.execute("select max(Fragment_Last_Used) from FRAGMENT;").fetchone()[0] or 0) + 1
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        """
+        Evicts least recently used fragments until the cache fits in max_bytes, then commits and closes
+        """
+        if not self.conn:
+            return
+        total = self.conn.execute("select coalesce(sum(Fragment_Size), 0) from FRAGMENT;").fetchone()[0]
+        if total > self.max_bytes:
+            cur = self.conn.execute("select Fragment_Key, Fragment_Size from FRAGMENT order by Fragment_Last_Used;")
+            expired = []
+            for key, size in cur:
+                if total <= self.max_bytes:
+                    break
+                expired.append((key,))
+                total -= size
+            self.conn.executemany("delete from FRAGMENT where Fragment_Key=?;", expired)
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+
+    @staticmethod
+    def make_key(*inputs):
+        """
+        Hashes everything a rendered fragment depends on (plus the template version) into a cache key
+        :param inputs: values the fragment is rendered from; dicts are hashed independent of their ordering
+        :return: hex digest used as cache key
+        """
+        normalized = [PLACEMARK_TEMPLATE_VERSION]
+        for value in inputs:
+            if isinstance(value, dict):
+                value = sorted(value.iteritems())
+            normalized.append(value)
+        return hashlib.sha1(cPickle.dumps(normalized, cPickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Looks up the rendered fragments of a whole batch with a few queries, marking those found as recently used
+        :param keys: list of cache keys from make_key()
+        :return: dictionary of key to fragment as string, for the keys that are cached
+        """
+        fragments = {}
+        unique_keys = list(set(keys))
+        for start in xrange(0, len(unique_keys), SQLITE_MAX_VARIABLES):
+            chunk = unique_keys[start:start + SQLITE_MAX_VARIABLES]
+            cur = self.conn.execute("select Fragment_Key, Fragment_Data from FRAGMENT where Fragment_Key in ({0});"
+                                    .format(', '.join(['?'] * len(chunk))), chunk)
+            fragments.update((key, str(data)) for key, data in cur)
+        self.conn.executemany("update FRAGMENT set Fragment_Last_Used=? where Fragment_Key=?;",
+                              [(self.generation, key) for key in fragments])
+        hits = sum(1 for key in keys if key in fragments)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return fragments
+
+    def put_many(self, fragments):
+        """
+        Stores rendered fragments
+        :param fragments: list of (cache key from make_key(), rendered fragment as string) pairs
+        """
+        self.conn.executemany("""
+            insert or replace into FRAGMENT (Fragment_Key, Fragment_Data, Fragment_Size, Fragment_Last_Used)
+            values (?, ?, ?, ?);""", [(key, sqlite3.Binary(fragment), len(fragment), self.generation)
+                                      for key, fragment in fragments])
+
+
 class Report(object):
     """
     Report object which combines data from multiple sources.
     """
-    def __init__(self, case_id, same_file, report_path):
+    # positions of sortable fields in LocatedCDRBatch.detailed_records(); report fields are in the dictionary at 3
+    SORT_FIELDS = {'CDR ID': 0, 'Latitude': 1, 'Longitude': 2, 'Called Number': 4, 'Cell Site ID': 5, 'Sector': 6}
+    DETAIL_SORT_FIELDS = ('Called Number', 'Cell Site ID', 'Sector')
+
+    def __init__(self, case_id, same_file, report_path, placemark_cache=None, spatial_filter=None,
+                 cluster_zoom_levels=None, sort_by=None, sort_memory=DEFAULT_SORT_MEMORY, sort_temp_dir=None):
         self.case_id = case_id
         self.same_file = same_file
         self.report_path = report_path
         self.report_name = self.get_report_name()
+        self.placemark_cache = placemark_cache
+        self.spatial_filter = spatial_filter
+        self.cluster_zoom_levels = cluster_zoom_levels
+        self.sort_by = sort_by  # list of field names to order points by, or None for import order
+        self.sort_memory = sort_memory  # bytes of points sorted in memory before spilling to sort_temp_dir
+        self.sort_temp_dir = sort_temp_dir
 
     def __str__(self):
         return 'Report object for case ID #', self.case_id
@@ -472,10 +1309,8 @@ class Report(object):
         Ensures case number can be used in file name without problematic characters
         :return: file name of map/report with .kml extension
         """
-        valid_chars = "-%s%s" % (string.ascii_letters, string.digits)
         case_number = TollsCase.get_case_number(self.case_id)
-        fn = ''.join([c for c in case_number if c in valid_chars])
-        return ''.join([fn, '.kml'])
+        return ''.join([Database.case_filename(case_number), '.kml'])
 
     def get_kml_header(self):
         case_details = TollsCase.get_case_details(self.case_id)
@@ -572,34 +1407,256 @@ class Report(object):
                                    analyst=self.xml_safe(case_details['Analyst']))
         return kml_header
 
-    @staticmethod
-    def has_value(coordinate):
-        if not coordinate or coordinate.strip() == '' or coordinate.strip() == 'NA':
-            return False
+    def get_batches_for_same_file(self, report_data):
+        """
+        Gets map points from report data when CDRs and towers are in the same file
+        :param report_data: LocatedCDRBatch of points keyed by row number (from pipeline.load_same_file)
+        :return: generator of LocatedCDRBatch objects
+        """
+        if self.spatial_filter:
+            report_data = report_data.select(self.spatial_filter.contains_many(report_data.latitudes,
+                                                                               report_data.longitudes))
+        yield report_data
+
+    def get_batches_for_separate_files(self):
+        """
+        Gets map points by linking imported CDRs to towers
+        :return: generator of LocatedCDRBatch objects
+        """
+        details = any(name in Report.DETAIL_SORT_FIELDS for name in self.sort_by or [])
+        return CDR.get_located_batches(self.case_id, self.spatial_filter, details=details)
+
+    def get_batches(self, data=None):
+        """
+        Gets map points for whichever kind of input this report was created for, in sort_by order if given
+        :param data: report data (only when CDRs and towers are in the same file)
+        :return: generator of LocatedCDRBatch objects
+        """
+        if not self.same_file:
+            batches = self.get_batches_for_separate_files()
+        elif data is None:
+            raise TypeError("Missing map data")
         else:
-            return True
-
-    def get_placemarks_for_same_file(self, report_data):
-        placemark_data = ""
-        for cdr_id, data in report_data.iteritems():
-            if self.has_value(data['Latitude']) and self.has_value(data['Longitude']):
-                placemark_data += self.generate_placemark(cdr_id, data['Latitude'], data['Longitude'],
-                                                          data['Other Fields'])
-        return placemark_data
+            batches = self.get_batches_for_same_file(data)
+        if self.sort_by:
+            return self.get_sorted_batches(batches)
+        return batches
 
-    def get_placemarks_for_separate_files(self):
-        cdrs_with_location_data = CDR.get_cdrs_with_location_data(self.case_id)
-        placemark_data = ""
-        for cdr_id in cdrs_with_location_data:
-            cdr_details = CDR.get_cdr_details(cdr_id, self.case_id)
-            tower_details = Tower.get_tower_location(self.case_id,
-                                                     cdr_details['Cell Site ID'],
-                                                     cdr_details['Sector'])
-            placemark_data += self.generate_placemark(cdr_id, tower_details['Latitude'], tower_details['Longitude'],
-                                                      cdr_details['Other Fields'])
-        return placemark_data
+    def get_sorted_batches(self, batches, batch_size=5000):
+        """
+        Orders map points by the report's sort_by fields with an external merge sort, so that reports larger than
+        memory can be sorted (e.g. chronologically, or grouped by tower)
+        :param batches: iterable of LocatedCDRBatch objects
+        :param batch_size: maximum number of points per sorted batch
+        :return: generator of LocatedCDRBatch objects (raises ValueError if a sort_by field does not exist)
+        """
+        records = (record for batch in batches for record in batch.detailed_records())
+        first = next(records, None)
+        if first is None:
+            return
+        key = self.sort_key(self.sort_by, first)
+        chunk = []
+        for record in external_sort(itertools.chain([first], records), key, self.sort_memory, self.sort_temp_dir):
+            chunk.append(record)
+            if len(chunk) >= batch_size:
+                yield LocatedCDRBatch.from_records(chunk)
+                chunk = []
+        if chunk:
+            yield LocatedCDRBatch.from_records(chunk)
+
+    @staticmethod
+    def sort_key(field_names, record):
+        """
+        Creates sort key function for map points. CDR ID, latitude, and longitude are compared as numbers; called
+        number, cell site ID, sector, and report fields are compared by their parsed value (see sort_value).
+        :param field_names: list of field names: 'CDR ID', 'Latitude', 'Longitude' (both together group points by
+                            tower), 'Called Number', 'Cell Site ID', 'Sector', or report fields such as a date and time
+        :param record: first record to be sorted, used to check that every field exists
+        :return: function of a tuple from LocatedCDRBatch.detailed_records() (raises ValueError for unknown fields)
+        """
+        fields = []
+        for name in field_names:
+            position = Report.SORT_FIELDS.get(name)
+            if position is not None and record[position] is not None:
+                fields.append((position, None))
+            elif name in record[3]:  # e.g. a "Sector" column selected as a report field of a same-file import
+                fields.append((3, name))
+            else:
+                raise ValueError(''.join(["Unknown sort_by field: ", name]))
+
+        cache = {}
+
+        def parse(value):
+            parsed = cache.get(value)
+            if parsed is None:
+                parsed = Report.sort_value(value)
+                if len(cache) < SORT_VALUE_CACHE_SIZE:
+                    cache[value] = parsed
+            return parsed
+
+        def key(record):
+            return tuple([record[position] if position < 3 else
+                          parse(record[position] if name is None else record[3].get(name, ''))
+                          for position, name in fields])
+        return key
+
+    @staticmethod
+    def sort_value(value):
+        """
+        Parses a field value so that records sort in a natural order: blanks first, then numbers, then dates and times
+        (M/D/Y, M/D/YY, or Y-M-D dates, optionally followed by an H:MM or H:MM:SS time with AM / PM; times alone sort
+        before any date), then anything else as text
+        :param value: field value as string
+        :return: tuple that compares in that order
+        """
+        s = value.strip()
+        if not s:
+            return (0,)
+        try:
+            number = float(s)
+            if not math.isnan(number) and not math.isinf(number):
+                return (1, number)
+        except ValueError:
+            pass
+
+        match = SORT_DATE_TIME.match(s.upper())
+        if match:
+            year, month, day, us_month, us_day, us_year, hour, minute, second, half = match.groups()
+            try:
+                if year:
+                    days = datetime.date(int(year), int(month), int(day)).toordinal()
+                elif us_year:
+                    full_year = int(us_year)
+                    if len(us_year) == 2:
+                        full_year += 2000 if full_year < 70 else 1900
+                    days = datetime.date(full_year, int(us_month), int(us_day)).toordinal()
+                else:
+                    days = 0
+                seconds = 0.0
+                if hour is not None:
+                    hour = int(hour)
+                    if half and not 1 <= hour <= 12:
+                        raise ValueError(s)
+                    if half:
+                        hour = hour % 12 + (12 if half == 'P' else 0)
+                    seconds = float(second or 0)
+                    if hour > 23 or int(minute) > 59 or seconds >= 60:
+                        raise ValueError(s)
+                    seconds += hour * 3600 + int(minute) * 60
+                return (2, days, seconds)
+            except ValueError:  # e.g. February 30th or 25:00
+                pass
+        return (3, s)
+
+    def get_clustered_placemarks(self, batches):
+        """
+        Generates one folder of cluster placemarks per zoom level, followed by the individual placemarks grouped by
+        grid cell. Regions make the viewer draw only the level matching the current zoom and only the visible cells.
+        :param batches: iterable of LocatedCDRBatch objects
+        :return: placemark data as string
+        """
+        points = LocatedCDRBatch.concatenate(batches)
+        if not len(points):
+            return ""
+        levels, point_cells = build_clusters(points.latitudes, points.longitudes, self.cluster_zoom_levels)
+        lods = lod_ranges(levels, CLUSTER_LOD_PIXELS)
+
+        placemark_data = []
+        for level, (min_pixels, max_pixels) in zip(levels, lods):
+            placemark_data.append(''.join(['<Folder><name>Clusters (zoom ', str(level.zoom), ')</name>']))
+            south, west, north, east = level.bounds()
+            for i in xrange(len(level)):
+                region = self.generate_region(south[i], west[i], north[i], east[i], min_pixels, max_pixels)
+                placemark_data.append(self.generate_cluster_placemark(level.counts[i], level.latitudes[i],
+                                                                      level.longitudes[i], region))
+            placemark_data.append('</Folder>')
+
+        # individual points appear once their cell is larger than CLUSTER_LOD_PIXELS on screen
+        min_pixels, max_pixels = lods[-1]
+        south, west, north, east = levels[-1].bounds()
+        placemark_data.append('<Folder><name>Points</name>')
+        order = np.argsort(point_cells, kind='mergesort')
+        cells = point_cells[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        for start, stop in zip(starts, np.r_[starts[1:], len(order)]):
+            cell = cells[start]
+            placemark_data.append(''.join(['<Folder>', self.generate_region(south[cell], west[cell], north[cell],
+                                                                            east[cell], min_pixels, max_pixels)]))
+            placemark_data.append(self.generate_placemarks(points.select(order[start:stop])))
+            placemark_data.append('</Folder>')
+        placemark_data.append('</Folder>')
+        return ''.join(placemark_data)
 
-    def generate_placemark(self, cdr_id, latitude, longitude, other):
+    @staticmethod
+    def generate_region(south, west, north, east, min_pixels, max_pixels):
+        return """
+        <Region>
+            <LatLonAltBox>
+                <north>{north}</north>
+                <south>{south}</south>
+                <east>{east}</east>
+                <west>{west}</west>
+            </LatLonAltBox>
+            <Lod>
+                <minLodPixels>{min_pixels}</minLodPixels>
+                <maxLodPixels>{max_pixels}</maxLodPixels>
+            </Lod>
+        </Region>""".format(north=repr(float(north)), south=repr(float(south)), east=repr(float(east)),
+                            west=repr(float(west)), min_pixels=min_pixels, max_pixels=max_pixels)
+
+    def generate_cluster_placemark(self, count, latitude, longitude, region):
+        return """
+        <Placemark>
+            <name>{count}</name>
+            <Snippet maxLines="0" />
+            <Style>
+                <IconStyle>
+                    <scale>{scale}</scale>
+                    <Icon>
+                        <href>http://maps.google.com/mapfiles/kml/paddle/ylw-circle.png</href>
+                    </Icon>
+                </IconStyle>
+            </Style>
+            {region}
+            <Point>
+                <altitudeMode>clampToGround</altitudeMode>
+                <coordinates>{longitude},{latitude},0</coordinates>
+            </Point>
+            <description>
+                <![CDATA[ {count} records near this location. Zoom in to see them. ]]>
+            </description>
+        </Placemark>""".format(count=int(count), scale='%.2f' % (1 + math.log10(count) / 2),
+                               region=region, longitude='%.6f' % longitude, latitude='%.6f' % latitude)
+
+    def generate_placemarks(self, batch):
+        """
+        Generates placemarks for a whole batch of map points, with excess whitespace removed. With an open placemark
+        cache, the batch's fragments are looked up together and only the points not found are rendered.
+        :param batch: LocatedCDRBatch object
+        :return: placemark data as string
+        """
+        records = batch.records()
+        render_placemark = self.render_placemark
+        strip_whitespace = self.strip_whitespace
+        if not (self.placemark_cache and self.placemark_cache.conn):
+            return ' '.join([strip_whitespace(render_placemark(*record)) for record in records])
+
+        make_key = PlacemarkCache.make_key
+        keys = [make_key(self.case_id, *record) for record in records]
+        fragments = self.placemark_cache.get_many(keys)
+        rendered = []
+        placemarks = []
+        for key, record in zip(keys, records):
+            fragment = fragments.get(key)
+            if fragment is None:
+                fragment = strip_whitespace(render_placemark(*record))
+                fragments[key] = fragment
+                rendered.append((key, fragment))
+            placemarks.append(fragment)
+        self.placemark_cache.put_many(rendered)
+        return ' '.join(placemarks)
+
+    def render_placemark(self, cdr_id, latitude, longitude, other):
         placemark_data = """
         <Placemark>
             <name><![CDATA[ {pk} ]]></name>
@@ -629,30 +1686,42 @@ class Report(object):
                                                               longitude=longitude, other_fields=other))
         return placemark_data
 
+    def export(self, sinks, data=None):
+        """
+        Resolves map points once and streams each batch to every sink (e.g. KML and GeoJSON) in a single pass. Reading
+        map points, rendering them, and writing the rendered text each run on their own thread, connected by bounded
+        queues, so database reads and disk writes overlap with rendering.
+        :param sinks: list of ReportSink objects
+        :param data: report data (only when CDRs and towers are in the same file)
+        :return: list of file paths written, in the same order as sinks
+        """
+        batches = read_ahead(self.get_batches(data))
+        writer = BackgroundWriter()
+        if self.placemark_cache:
+            self.placemark_cache.open()  # rendering stays on this thread, which owns the cache connection
+        try:
+            for sink in sinks:
+                sink.open()
+            for batch in batches:
+                writer.write([(sink.f, sink.render(batch)) for sink in sinks])
+            writer.close()  # every batch is on disk before the sinks write what comes after the last point
+            for sink in sinks:
+                sink.finish()
+        finally:
+            writer.close(discard=True)
+            batches.close()
+            for sink in sinks:
+                sink.close()
+            if self.placemark_cache:
+                self.placemark_cache.close()
+        return [sink.path for sink in sinks]
+
     def generate_map(self, data=None):
         """
         Generates kml map file, linking tower and CDR data as needed
         :return: file path of map file
         """
-        kml_header = self.get_kml_header()
-        kml_footer = """
-            </Document>
-        </kml>"""
-
-        if not self.same_file:
-            placemarks = self.get_placemarks_for_separate_files()
-        else:
-            if not data:
-                raise TypeError("Missing map data")
-            else:
-                placemarks = self.get_placemarks_for_same_file(data)
-
-        with open(os.path.join(self.report_path, self.report_name), 'wb') as f:
-            f.write(self.strip_whitespace(kml_header))
-            f.write(self.strip_whitespace(placemarks))
-            f.write(self.strip_whitespace(kml_footer))
-
-        return os.path.join(self.report_path, self.report_name)
+        return self.export([KMLSink(self, os.path.join(self.report_path, self.report_name))], data)[0]
 
     @staticmethod
     def strip_whitespace(s):
@@ -680,4 +1749,106 @@ class Report(object):
 
         s = str(s).strip().replace('\r', '').replace('\n', '')
 
-        return ''.join(unsafe.get(c, c) for c in s)
\ No newline at end of file
+        return ''.join(unsafe.get(c, c) for c in s)
+
+
+class ReportSink(object):
+    """
+    Output format for Report.export(). Sinks render map points a batch at a time; the rendered text is written out as
+    it arrives rather than holding the whole report in memory.
+    """
+    extension = ''
+
+    def __init__(self, report, path):
+        self.report = report
+        self.path = path
+        self.f = None
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return ''.join((type(self).__name__, '(', repr(self.report), ', ', repr(self.path), ')'))
+
+    def open(self):
+        """
+        Opens output file and writes anything that comes before the first point
+        """
+        self.f = open(self.path, 'wb', WRITE_BUFFER_SIZE)
+        self.f.write(self.header())
+
+    def header(self):
+        """
+        :return: text that comes before the first point
+        """
+        return ''
+
+    def render(self, batch):
+        """
+        Renders map points (called once per batch, in order, but the text may be written out later)
+        :param batch: LocatedCDRBatch object
+        :return: rendered text
+        """
+        raise NotImplementedError
+
+    def footer(self):
+        """
+        :return: text that comes after the last point
+        """
+        return ''
+
+    def write(self, batch):
+        """
+        Renders and writes map points straight away
+        :param batch: LocatedCDRBatch object
+        """
+        self.f.write(self.render(batch))
+
+    def finish(self):
+        """
+        Writes anything that comes after the last point (only called if every batch was written)
+        """
+        self.f.write(self.footer())
+
+    def close(self):
+        """
+        Closes output file (always called, even after an error)
+        """
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+class KMLSink(ReportSink):
+    """
+    KML map file. Placemarks are rendered as each batch arrives, except for clustered reports, which need every point
+    before clusters can be built.
+    """
+    extension = '.kml'
+
+    def __init__(self, report, path):
+        super(KMLSink, self).__init__(report, path)
+        self.batches = []
+        self.separator = ''  # placemarks of consecutive batches are separated by a space, as within a batch
+
+    def header(self):
+        return Report.strip_whitespace(self.report.get_kml_header())
+
+    def render(self, batch):
+        if self.report.cluster_zoom_levels:
+            self.batches.append(batch)
+            return ''
+        if not len(batch):
+            return ''
+        placemark_data = ''.join([self.separator, self.report.generate_placemarks(batch)])
+        self.separator = ' '
+        return placemark_data
+
+    def footer(self):
+        placemark_data = ''
+        if self.report.cluster_zoom_levels:
+            placemark_data = Report.strip_whitespace(self.report.get_clustered_placemarks(self.batches))
+            self.batches = []
+        return ''.join([placemark_data, Report.strip_whitespace("""
+            </Document>
+        </kml>""")])
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+CDR Mapper import, mapping, and report pipeline. This module has no GUI dependencies, so it can be used from scripts
+and worker processes (and on servers without a display); cdrmapper.py is the interactive front end.
+"""
+
+import csv
+import multiprocessing
+import numpy as np
+import os
+import Queue
+import sqlite3
+import threading
+import traceback
+from clustering import DEFAULT_ZOOM_LEVELS
+from coordinates import COORDINATE_OK, summarize_status
+from dedup import DuplicateFilter
+from exporters import create_sinks
+from extsort import DEFAULT_SORT_MEMORY
+from models import (Database, DimensionEncoder, Tower, TowerBatch, CDR, CDRBatch, LocatedCDRBatch, PlacemarkCache,
+                    Report)
+from sitekeys import is_hex_column
+from snapshot import read_columns, read_coordinates, read_digests
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+INGEST_BATCH_SIZE = 5000  # rows handed from a parser to the database writer at a time
+INGEST_QUEUE_SIZE = 8  # parsed batches waiting for the writer before parsers block
+
+
+class ParseError(Exception):
+    """
+    Failure of a parser worker; the message is the worker's formatted traceback, since the original exception and
+    traceback do not survive being sent back from a worker process
+    """
+    pass
+
+
+def initialize_database(case_number=None):
+    """
+    Initializes database and makes it the active database for this process
+    :param case_number: case number whose database is initialized, or None for the default database
+    :return: destroys existing database for this case and creates new one (other cases are left untouched)
+    """
+    if case_number is None:
+        database = Database()
+    else:
+        database = Database.for_case(case_number)
+    if not os.path.isfile(database.database_filename):
+        database.create_tables()
+    else:
+        destroy_database(database)
+        database.create_tables()
+    database.activate()
+    return database
+
+
+def destroy_database(database=None):
+    """
+    Delete sqlite database
+    :param database: Database object to delete, or None for the active database
+    :return: database is deleted
+    """
+    if database is None:
+        database = Database()
+    if os.path.isfile(database.database_filename):
+        os.remove(database.database_filename)
+
+
+def read_headers(path):
+    """
+    Extract headers from CSV file without prompting the user
+    :param path: file path to CSV file
+    :return: list containing headers in original order
+    """
+    with open(path, 'rb') as f:
+        return next(csv.reader(f))
+
+
+def get_other_fields(headers, other_fields, knowns):
+    """
+    Maps report field names to column indexes, skipping columns already used as required fields
+    :param headers: list of CSV headers
+    :param other_fields: list of column headings selected for the report
+    :param knowns: list of column indexes of required fields
+    :return: dictionary of report field names to column indexes
+    """
+    return {of: headers.index(of) for of in other_fields if headers.index(of) not in knowns and of.strip() != ''}
+
+
+def parse_towers(case_id, tower_file, i_cell_site, i_latitude, i_longitude, i_sector, i_azimuth):
+    """
+    Parses tower CSV file once the columns are known
+    :param case_id: primary key of case
+    :param tower_file: file path to tower CSV file
+    :param i_cell_site: column index of cell site / tower ID
+    :param i_latitude: column index of latitude
+    :param i_longitude: column index of longitude
+    :param i_sector: column index of sector
+    :param i_azimuth: column index of azimuth
+    :return: tuple of (generator of TowerBatch objects, dictionary of problem description to number of towers
+             skipped because of bad coordinates)
+    """
+    cell_sites, sectors, azimuths = read_columns(tower_file, [i_cell_site, i_sector, i_azimuth])
+    latitude, longitude, status = read_coordinates(tower_file, i_latitude, i_longitude)
+    valid = np.flatnonzero(status == COORDINATE_OK)
+    latitude = np.round(latitude[valid], 6)  # roughly 0.1 m
+    longitude = np.round(longitude[valid], 6)
+    hex_cell_sites = is_hex_column(cell_sites)
+
+    def batches():
+        for start, stop in batch_slices(len(valid)):
+            rows = valid[start:stop].tolist()
+            yield TowerBatch(case_id, [cell_sites[i] for i in rows], latitude[start:stop], longitude[start:stop],
+                             [sectors[i] for i in rows], [azimuths[i] for i in rows], hex_cell_sites)
+
+    return batches(), summarize_status(status)
+
+
+def describe_rejected(rejected):
+    """
+    Describes rows skipped because of bad coordinates or duplication, or left off the map because no tower matches
+    :param rejected: dictionary of problem description to number of rows
+    :return: message for user (empty string if nothing was skipped)
+    """
+    if not rejected:
+        return ''
+    problems = ', '.join(['%s: %d' % (k, v) for k, v in sorted(rejected.iteritems())])
+    return ''.join(['Rows skipped (', problems, ').'])
+
+
+def find_unique_rows(path, duplicate_key=None):
+    """
+    Finds rows of a CSV file that do not repeat an earlier row, from a snapshot of the rows' key digests if the file
+    was read before (see snapshot.read_digests)
+    :param path: file path to CSV file
+    :param duplicate_key: list of column headings that identify a record, None to compare whole rows (exact duplicates
+                          only), or an empty list to keep duplicates
+    :return: tuple of (sorted int array of indexes of rows to keep, or None to keep every row; dictionary of problem
+             description to number of rows skipped because they are duplicates)
+    """
+    if duplicate_key is not None and not duplicate_key:
+        return None, {}
+    key = None
+    if duplicate_key is not None:
+        headers = read_headers(path)
+        missing = [name for name in duplicate_key if name not in headers]
+        if missing:
+            raise ValueError(''.join(["Duplicate key columns not found: ", ', '.join(missing)]))
+        key = [headers.index(name) for name in duplicate_key]
+    duplicates = DuplicateFilter()
+    keep = duplicates.unique_digests(read_digests(path, key))
+    return keep, duplicates.summarize()
+
+
+def parse_cdrs(case_id, cdr_file, i_called_number, i_cell_site_id, i_sector, d_other_fields, duplicate_key=None):
+    """
+    Parses CDR CSV file once the columns are known, dropping duplicate records
+    :param case_id: primary key of case
+    :param cdr_file: file path to CDR CSV file
+    :param i_called_number: column index of called number
+    :param i_cell_site_id: column index of cell site / tower ID
+    :param i_sector: column index of sector
+    :param d_other_fields: dictionary of report field names to column indexes
+    :param duplicate_key: list of column headings that identify a record (see find_unique_rows)
+    :return: tuple of (generator of CDRBatch objects, dictionary of problem description to number of CDRs skipped
+             because they are duplicates)
+    """
+    other_names = d_other_fields.keys()
+    keep, rejected = find_unique_rows(cdr_file, duplicate_key)
+    columns = read_columns(cdr_file, [i_called_number, i_cell_site_id, i_sector] +
+                           [d_other_fields[k] for k in other_names])
+    hex_cell_sites = is_hex_column(columns[1])
+    if keep is not None and len(keep) < len(columns[0]):
+        rows = keep.tolist()
+        columns = [[column[i] for i in rows] for column in columns]
+
+    def batches():
+        for start, stop in batch_slices(len(columns[0])):
+            yield CDRBatch(case_id, columns[0][start:stop], columns[1][start:stop], columns[2][start:stop],
+                           other_names, [column[start:stop] for column in columns[3:]], hex_cell_sites)
+
+    return batches(), rejected
+
+
+def load_same_file(data, i_latitude, i_longitude, d_other_fields, duplicate_key=None):
+    """
+    Reads CSV file containing both CDR and tower data once the columns are known, dropping duplicate records
+    :param data: file path to CSV file
+    :param i_latitude: column index of latitude
+    :param i_longitude: column index of longitude
+    :param d_other_fields: dictionary of report field names to column indexes
+    :param duplicate_key: list of column headings that identify a record (see find_unique_rows)
+    :return: tuple of (LocatedCDRBatch of map points identified by row number, dictionary of problem description to
+             number of rows skipped because of bad coordinates or duplication)
+    """
+    other_names = d_other_fields.keys()
+    keep, rejected = find_unique_rows(data, duplicate_key)
+    columns = read_columns(data, [d_other_fields[k] for k in other_names])
+    latitude, longitude, status = read_coordinates(data, i_latitude, i_longitude)
+    if keep is not None:  # duplicates are counted once, as duplicates, even if their coordinates are bad too
+        unique = np.zeros(status.shape, dtype=bool)
+        unique[keep] = True
+        status = np.where(unique, status, COORDINATE_OK)
+    else:
+        unique = np.ones(status.shape, dtype=bool)
+    valid = np.flatnonzero((status == COORDINATE_OK) & unique)
+    rejected.update(summarize_status(status))
+    rows = valid.tolist()
+    other_columns = [[column[i] for i in rows] for column in columns]
+    if other_names:
+        other_fields = [dict(zip(other_names, values)) for values in zip(*other_columns)]
+    else:
+        other_fields = [{} for i in rows]
+    report_data = LocatedCDRBatch((valid + 1).tolist(),  # row numbers so points can be traced back to the file
+                                  np.round(latitude[valid], 6), np.round(longitude[valid], 6), other_fields)
+    return report_data, rejected
+
+
+def batch_slices(count):
+    """
+    Splits rows into batches of INGEST_BATCH_SIZE
+    :param count: number of rows
+    :return: generator of (start, stop) pairs
+    """
+    for start in xrange(0, count, INGEST_BATCH_SIZE):
+        yield start, min(start + INGEST_BATCH_SIZE, count)
+
+
+def parse_worker(batches, parser, case_id, columns):
+    """
+    Parses one input file into batches of database rows for load_two_files (runs in a thread or process)
+    :param batches: queue receiving (model class name, list of row tuples) pairs, then a final (None, result) pair,
+                    where result is the parser's dictionary of skipped rows or a ParseError
+    :param parser: name of parse function (parse_towers or parse_cdrs)
+    :param case_id: primary key of case
+    :param columns: tuple returned by select_tower_data() or select_cdrs()
+    :return: n/a
+    """
+    result = {}
+    try:
+        records, result = globals()[parser](case_id, *columns)  # result is complete once records are consumed
+        for batch in records:
+            batches.put((batch.model.__name__, batch.rows()))
+    except Exception:
+        result = ParseError(traceback.format_exc())
+    batches.put((None, result))  # tells writer this parser is finished
+
+
+def load_two_files(case_id, tower_columns, cdr_columns):
+    """
+    Imports towers and CDRs at the same time. Each file is parsed by its own worker process into batches of database
+    rows, which are handed to a single writer (the calling thread), so the database only ever has one writer. Inside
+    daemonic processes (e.g. jobs.py workers, which cannot start processes) the parsers run on threads instead.
+    :param case_id: primary key of case
+    :param tower_columns: tuple returned by select_tower_data()
+    :param cdr_columns: tuple returned by select_cdrs(), optionally followed by a duplicate key (see parse_cdrs)
+    :return: dictionary of problem description to number of towers skipped because of bad coordinates, CDRs skipped
+             because they are duplicates, and CDRs left off the map because no tower, or more than one, matches their
+             cell site / sector (raises ParseError, after rolling back, if either file could not be parsed)
+    """
+    if multiprocessing.current_process().daemon:
+        batches = Queue.Queue(maxsize=INGEST_QUEUE_SIZE)  # bounded so parsers cannot run far ahead of the writer
+        worker = threading.Thread
+    else:
+        batches = multiprocessing.Queue(maxsize=INGEST_QUEUE_SIZE)
+        worker = multiprocessing.Process
+    parsers = [worker(target=parse_worker, args=(batches, 'parse_towers', case_id, tower_columns)),
+               worker(target=parse_worker, args=(batches, 'parse_cdrs', case_id, cdr_columns))]
+    for parser in parsers:
+        parser.daemon = True
+        parser.start()
+
+    models = {'Tower': Tower, 'CDR': CDR}
+    results = []
+    failed = False
+    unmatched = {}
+    conn = sqlite3.connect(Database().database_filename)
+    conn.text_factory = str
+    try:
+        encoder = DimensionEncoder(conn)  # the writer interns values for both parsers, so keys are shared
+        last_tower_id = Tower.get_last_id(conn)
+        while len(results) < len(parsers):
+            model, rows = batches.get()
+            if model is None:
+                results.append(rows)
+                failed = failed or isinstance(rows, Exception)
+            elif not failed:  # after a failure only drain the queue
+                models[model].insert_rows(conn, rows, encoder)
+        if failed:  # nothing from a partly parsed case is kept
+            conn.rollback()
+        else:
+            Tower.index_locations(conn, last_tower_id)
+            unmatched = CDR.match_towers(conn, case_id)
+            conn.commit()
+    finally:
+        conn.close()
+
+    for parser in parsers:
+        parser.join()
+    rejected = {}
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        rejected.update(result)
+    rejected.update(unmatched)
+    return rejected
+
+
+def export_report(case_id, save_location, report_data=None, spatial_filter=None, cluster=False, formats=('kml',),
+                  sort_by=None, sort_memory=DEFAULT_SORT_MEMORY):
+    """
+    Writes map / data files for case in several formats at once, reusing placemarks cached from earlier runs
+    :param case_id: primary key of case
+    :param save_location: directory path where files are written
+    :param report_data: report data from same file, or None if towers and CDRs were imported separately
+    :param spatial_filter: SpatialFilter limiting the map to an area, or None for all locations
+    :param cluster: True to group nearby points into clusters when zoomed out (KML and KMZ only)
+    :param formats: list of format names (see exporters.EXPORT_FORMATS)
+    :param sort_by: list of field names to order records by (see Report.sort_key), or None for import order
+    :param sort_memory: bytes of records sorted in memory before spilling to temporary files
+    :return: list of file paths written
+    """
+    placemark_cache = PlacemarkCache(Database().placemark_cache_filename)
+    cluster_zoom_levels = DEFAULT_ZOOM_LEVELS if cluster else None
+    final_report = Report(case_id, report_data is not None, save_location, placemark_cache=placemark_cache,
+                          spatial_filter=spatial_filter, cluster_zoom_levels=cluster_zoom_levels, sort_by=sort_by,
+                          sort_memory=sort_memory)
+    return final_report.export(create_sinks(final_report, formats), data=report_data)
+
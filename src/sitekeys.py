@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Normalized cell site / sector matching keys. Carriers format the same cell site differently in tower lists and CDRs
+(leading zeros, hex or decimal LAC / CID, "1" versus "001" sectors), so towers and CDRs that do not match on the text
+as given are matched on a normalized key computed once per row during import.
+"""
+
+import re
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+SEPARATORS = re.compile(r'[^0-9A-Z]+')  # anything between the parts of a composite ID such as LAC-CID
+MIN_IMPLICIT_HEX = 4  # unmarked hex (e.g. "1A2B") must be at least a 16-bit LAC / CID, so "1B" stays a name
+MARKED_HEX_PART = re.compile(r'^(?:0X([0-9A-F]+)|([0-9A-F]+)H)$')
+IMPLICIT_HEX_PART = re.compile(r'^(?=[0-9A-F]*[0-9])(?=[0-9A-F]*[A-F])[0-9A-F]{%d,}$' % MIN_IMPLICIT_HEX)
+HEX_NUMBER_PART = re.compile(r'^(?=[0-9A-F]*[0-9])[0-9A-F]+$')  # letter-only parts such as "BEEF" stay names
+
+
+def is_hex_column(values):
+    """
+    Decides once for a whole column of cell site IDs whether its unmarked numbers are hex: they are if any part mixes
+    at least MIN_IMPLICIT_HEX digits and letters A-F (e.g. "1A2B"). Deciding per value instead would read "1A2B" as hex
+    and "6699" as decimal, so two different towers in one list would both become 6699.
+    :param values: sequence of cell site IDs as given in the CSV file
+    :return: True if unmarked numbers in the column are hex
+    """
+    for value in set(values):
+        for part in SEPARATORS.split(value.upper()):
+            if IMPLICIT_HEX_PART.match(part):
+                return True
+    return False
+
+
+def normalize_part(part, allow_hex, hex_column=False):
+    """
+    Normalizes one part of an identifier: numbers lose their leading zeros and, if allowed, hex numbers ("0x1A", "1Ah",
+    or any number in a hex column) are converted to decimal
+    :param part: upper case string of letters and digits
+    :param allow_hex: True to recognize hex numbers
+    :param hex_column: True if unmarked numbers are hex (see is_hex_column)
+    :return: normalized part
+    """
+    if allow_hex:
+        match = MARKED_HEX_PART.match(part)
+        if match:
+            return str(int(match.group(1) or match.group(2), 16))
+        if hex_column and HEX_NUMBER_PART.match(part):
+            return str(int(part, 16))
+    if part.isdigit():
+        return str(int(part))
+    return part
+
+
+def normalize_id(value, allow_hex=True, hex_column=None):
+    """
+    Normalizes a cell site ID or sector, ignoring case, whitespace, and separators between its parts
+    :param value: identifier as given in the CSV file
+    :param allow_hex: True to recognize hex numbers (cell site IDs); sectors such as "A" must not be read as numbers
+    :param hex_column: True or False if decided for the value's whole column (see is_hex_column), or None to decide
+                       from the value alone
+    :return: normalized identifier (parts joined by '-')
+    """
+    if allow_hex and hex_column is None:
+        hex_column = is_hex_column([value])
+    parts = [p for p in SEPARATORS.split(value.upper()) if p]
+    return '-'.join([normalize_part(p, allow_hex, hex_column) for p in parts])
+
+
+def site_match_keys(cell_site_ids, sectors, hex_cell_sites=None):
+    """
+    Computes the matching key of each cell site / sector pair (each distinct pair is only normalized once)
+    :param cell_site_ids: sequence of cell site IDs
+    :param sectors: sequence of sectors, in the same order as cell_site_ids
+    :param hex_cell_sites: True or False if decided for the whole file column the cell site IDs come from (see
+                           is_hex_column), or None to decide from cell_site_ids
+    :return: list of matching keys, e.g. "1234-6699/1" for cell site "01234-0x1A2B", sector "001"
+    """
+    if hex_cell_sites is None:
+        hex_cell_sites = is_hex_column(cell_site_ids)
+    keys = {}
+    match_keys = []
+    for pair in zip(cell_site_ids, sectors):
+        key = keys.get(pair)
+        if key is None:
+            key = ''.join([normalize_id(pair[0], hex_column=hex_cell_sites), '/',
+                           normalize_id(pair[1], allow_hex=False)])
+            keys[pair] = key
+        match_keys.append(key)
+    return match_keys
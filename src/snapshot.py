@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+Binary snapshots of parsed CSV input files, so the same tower list or CDR export is only parsed once. Columns are
+stored as typed NumPy arrays (text as fixed-width strings, coordinates already validated as floats) and memory-mapped
+when loaded, so a snapshot costs little more than the pages actually read.
+"""
+
+import csv
+import hashlib
+import marshal
+import operator
+import os
+import shutil
+import tempfile
+import numpy as np
+from coordinates import validate_coordinates
+from dedup import digest_keys
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+SNAPSHOT_FORMAT_VERSION = 2  # bump whenever the layout written by InputSnapshot.save() changes
+SNAPSHOT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # least recently used snapshots are deleted beyond this total size
+METADATA_FILENAME = 'metadata'
+
+
+class InputSnapshot(object):
+    """
+    Column-projected, parsed form of a CSV file stored as a directory of .npy arrays. A snapshot is keyed by file path,
+    the projected columns, and the kind of parsing done, and is only used while the file's size, modification time, and
+    content hash still match.
+    """
+    snapshot_folder = os.path.join(os.path.dirname(__file__), 'snapshots')
+
+    def __init__(self, path, columns, kind='text'):
+        self.path = os.path.abspath(path)
+        self.columns = tuple(columns)
+        self.kind = kind
+        key = hashlib.sha1(repr((SNAPSHOT_FORMAT_VERSION, self.path, self.columns, self.kind))).hexdigest()
+        self.snapshot_directory = os.path.join(self.snapshot_folder, key)
+
+    def __str__(self):
+        return self.snapshot_directory
+
+    def __repr__(self):
+        return ''.join(('InputSnapshot(', repr(self.path), ', ', repr(self.columns), ', ', repr(self.kind), ')'))
+
+    @staticmethod
+    def content_hash(path):
+        """
+        Hashes file contents in large blocks (much cheaper than parsing the file)
+        :param path: file path
+        :return: hex digest of file contents
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), ''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def load(self):
+        """
+        Loads snapshot if it is still current for the source file
+        :return: tuple of read-only memory-mapped arrays, one per stored array, or None if there is no current snapshot
+        """
+        metadata_filename = os.path.join(self.snapshot_directory, METADATA_FILENAME)
+        try:
+            stat = os.stat(self.path)
+            with open(metadata_filename, 'rb') as f:
+                metadata = marshal.load(f)
+            if metadata['size'] != stat.st_size:
+                return None
+            touched = metadata['mtime'] != stat.st_mtime
+            if touched:
+                # file was touched or copied; only trust the snapshot if the contents are unchanged
+                digest = self.content_hash(self.path)
+                if metadata['sha1'] != digest:
+                    return None
+            data = tuple(np.load(os.path.join(self.snapshot_directory, ''.join([str(i), '.npy'])), mmap_mode='r')
+                         for i in xrange(metadata['arrays']))
+            os.utime(metadata_filename, None)  # marks snapshot as recently used, for evict_snapshots()
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+            return None
+
+        if touched:
+            self.write_metadata(self.snapshot_directory, digest)
+        return data
+
+    def save(self, data, digest=None):
+        """
+        Writes snapshot atomically so concurrent workers never read a partial snapshot, then evicts old snapshots
+        :param data: sequence of arrays
+        :param digest: content hash of source file if already known
+        """
+        if not os.path.isdir(self.snapshot_folder):
+            try:
+                os.makedirs(self.snapshot_folder)
+            except OSError:  # created by another worker in the meantime
+                if not os.path.isdir(self.snapshot_folder):
+                    raise
+        temp_directory = tempfile.mkdtemp(dir=self.snapshot_folder, suffix='.tmp')
+        try:
+            for i, array in enumerate(data):
+                np.save(os.path.join(temp_directory, ''.join([str(i), '.npy'])), np.asarray(array))
+            self.write_metadata(temp_directory, digest, len(data))
+            if os.path.exists(self.snapshot_directory):  # os.rename does not replace existing directories
+                shutil.rmtree(self.snapshot_directory)
+            os.rename(temp_directory, self.snapshot_directory)
+        except (IOError, OSError):
+            shutil.rmtree(temp_directory, ignore_errors=True)
+        evict_snapshots(self.snapshot_folder, keep=self.snapshot_directory)
+
+    def write_metadata(self, directory, digest=None, arrays=None):
+        """
+        Records the state of the source file a snapshot was made from, replacing any earlier metadata
+        :param directory: snapshot directory
+        :param digest: content hash of source file if already known
+        :param arrays: number of arrays in the snapshot, or None to keep the number already recorded
+        """
+        metadata_filename = os.path.join(directory, METADATA_FILENAME)
+        if arrays is None:
+            with open(metadata_filename, 'rb') as f:
+                arrays = marshal.load(f)['arrays']
+        stat = os.stat(self.path)
+        metadata = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest or self.content_hash(self.path),
+            'arrays': arrays
+        }
+        fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(metadata, f)
+            if os.path.exists(metadata_filename):  # os.rename does not replace existing files on Windows
+                os.remove(metadata_filename)
+            os.rename(temp_filename, metadata_filename)
+        except (IOError, OSError):
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+
+def evict_snapshots(folder, max_bytes=SNAPSHOT_MAX_BYTES, keep=None):
+    """
+    Deletes least recently used snapshots until the folder is no larger than max_bytes. Snapshots in use elsewhere
+    (e.g. memory-mapped by another worker on Windows) are skipped.
+    :param folder: snapshot folder
+    :param max_bytes: largest total size of snapshots to keep
+    :param keep: snapshot directory that is never deleted (e.g. the one just written)
+    :return: n/a
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if path == keep or name.endswith('.tmp'):  # .tmp directories are still being written by other workers
+            continue
+        try:
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                metadata_filename = os.path.join(path, METADATA_FILENAME)
+                used = os.path.getmtime(metadata_filename if os.path.exists(metadata_filename) else path)
+            else:  # snapshot from an older format version
+                size = os.path.getsize(path)
+                used = os.path.getmtime(path)
+        except OSError:  # deleted by another worker in the meantime
+            continue
+        entries.append((used, size, path))
+        total += size
+    if keep is not None:
+        try:
+            total += sum(os.path.getsize(os.path.join(keep, f)) for f in os.listdir(keep))
+        except OSError:  # snapshot could not be written
+            pass
+
+    for used, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def parse_columns(path, columns):
+    """
+    Reads selected columns of a CSV file (excluding the header row)
+    :param path: file path to CSV file
+    :param columns: list of column indexes to read
+    :return: tuple containing one list of values per requested column, in the order requested
+    """
+    data = tuple([] for c in columns)
+    appenders = [(column.append, i) for column, i in zip(data, columns)]
+    with open(path, 'rb') as f:
+        f_csv = csv.reader(f)
+        discarded_headers = next(f_csv)
+        for row in f_csv:
+            for append, i in appenders:
+                append(row[i])
+    return data
+
+
+def parse_keys(path, columns=None):
+    """
+    Reads the key of each row of a CSV file (excluding the header row)
+    :param path: file path to CSV file
+    :param columns: list of column indexes making up the key, or None to use whole rows
+    :return: generator of key strings (the key columns joined by NUL)
+    """
+    with open(path, 'rb') as f:
+        f_csv = csv.reader(f)
+        discarded_headers = next(f_csv)
+        if columns is None:
+            for row in f_csv:
+                yield '\x00'.join(row)
+        elif len(columns) == 1:
+            i = columns[0]
+            for row in f_csv:
+                yield row[i]
+        else:
+            key_columns = operator.itemgetter(*columns)
+            for row in f_csv:
+                yield '\x00'.join(key_columns(row))
+
+
+def read_columns(path, columns):
+    """
+    Reads selected columns of a CSV file (excluding the header row), using a snapshot from a previous read if possible
+    :param path: file path to CSV file
+    :param columns: list of column indexes to read
+    :return: tuple containing one list of values per requested column, in the order requested
+    """
+    snapshot = InputSnapshot(path, columns)
+    data = snapshot.load()
+    if data is not None:
+        return tuple(array.tolist() for array in data)
+
+    data = parse_columns(path, columns)
+    snapshot.save([np.array(column, dtype=np.str_) for column in data])
+    return data
+
+
+def read_coordinates(path, i_latitude, i_longitude):
+    """
+    Reads and validates the latitude and longitude columns of a CSV file, using a snapshot of the parsed coordinates
+    from a previous read if possible (so they are not parsed again)
+    :param path: file path to CSV file
+    :param i_latitude: column index of latitude
+    :param i_longitude: column index of longitude
+    :return: tuple returned by coordinates.validate_coordinates() (arrays may be read-only)
+    """
+    snapshot = InputSnapshot(path, [i_latitude, i_longitude], kind='coordinates')
+    data = snapshot.load()
+    if data is not None:
+        return data
+
+    data = validate_coordinates(*parse_columns(path, [i_latitude, i_longitude]))
+    snapshot.save(data)
+    return data
+
+
+def read_digests(path, columns=None):
+    """
+    Hashes the key of each row of a CSV file (see dedup.digest_keys), using a snapshot of the digests from a previous
+    read if possible (so duplicate detection neither parses nor hashes the file again)
+    :param path: file path to CSV file
+    :param columns: list of column indexes making up the key, or None to use whole rows
+    :return: array of digests (dtype S16, may be read-only), one per row
+    """
+    if columns is None:
+        snapshot = InputSnapshot(path, [], kind='row digests')
+    else:
+        snapshot = InputSnapshot(path, columns, kind='digests')
+    data = snapshot.load()
+    if data is not None:
+        return data[0]
+
+    digests = digest_keys(parse_keys(path, columns))
+    snapshot.save([digests])
+    return digests
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Background stages for pipelined report generation: map points are read ahead on one thread and rendered text is
+written out on another, so database reads, rendering, and disk writes overlap. Stages are connected by bounded queues,
+so a slow stage holds the others back instead of letting memory grow.
+"""
+
+import Queue
+import threading
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+STAGE_QUEUE_SIZE = 8  # items waiting between two stages before the faster one blocks
+WRITE_BUFFER_SIZE = 1024 * 1024  # bytes buffered per output file before it is written to disk
+END = object()  # marks the end of a stage's output
+
+
+def produce(items, iterable, stopped):
+    """
+    Puts every item of an iterable on a queue, then END followed by the exception that stopped it (or None)
+    :param items: bounded queue
+    :param iterable: iterable producing the items (consumed and closed on this thread, e.g. so a generator's database
+                     connection is closed by the thread that opened it)
+    :param stopped: threading.Event set by the consumer when it no longer wants items
+    :return: n/a
+    """
+    error = None
+    try:
+        for item in iterable:
+            if stopped.is_set():
+                break
+            items.put(item)
+    except Exception as e:
+        error = e
+    finally:
+        try:
+            getattr(iterable, 'close', lambda: None)()
+        except Exception as e:  # reported like any other failure, so the consumer is never left waiting for END
+            error = error or e
+    items.put(END)
+    items.put(error)
+
+
+def read_ahead(iterable, queue_size=STAGE_QUEUE_SIZE):
+    """
+    Consumes an iterable on a background thread, staying up to queue_size items ahead of the caller (e.g. so the next
+    batch is fetched from the database while the current one is rendered)
+    :param iterable: iterable to consume; it is only ever used from the background thread
+    :param queue_size: most items waiting for the caller
+    :return: generator of the iterable's items; exceptions raised by the iterable are raised again here
+    """
+    items = Queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    producer = threading.Thread(target=produce, args=(items, iterable, stopped))
+    producer.daemon = True
+    producer.start()
+    finished = False
+    try:
+        while True:
+            item = items.get()
+            if item is END:
+                finished = True
+                error = items.get()
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        if not finished:  # caller stopped early: unblock the producer and wait for it to let go of the iterable
+            stopped.set()
+            while items.get() is not END:
+                pass
+        producer.join()
+
+
+class BackgroundWriter(object):
+    """
+    Writes text to open files on a background thread, in the order it was queued. After a failed write the remaining
+    text is discarded and the error is raised by the next call to write() or close().
+    """
+    def __init__(self, queue_size=STAGE_QUEUE_SIZE):
+        self.chunks = Queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.discarding = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __str__(self):
+        return ''.join(('BackgroundWriter (', str(self.chunks.qsize()), ' waiting)'))
+
+    def __repr__(self):
+        return ''.join(('BackgroundWriter(', repr(self.chunks.maxsize), ')'))
+
+    def run(self):
+        while True:
+            chunks = self.chunks.get()
+            if chunks is END:
+                return
+            if self.error is None and not self.discarding:  # after a failure only drain the queue
+                try:
+                    for f, text in chunks:
+                        if text:
+                            f.write(text)
+                except Exception as e:
+                    self.error = e
+
+    def write(self, chunks):
+        """
+        Queues text to be written, blocking while the queue is full
+        :param chunks: list of (file object, string) pairs
+        """
+        if self.error is not None:
+            raise self.error
+        self.chunks.put(chunks)
+
+    def close(self, discard=False):
+        """
+        Waits until all queued text is written (safe to call more than once)
+        :param discard: True to drop text still waiting and ignore write errors (e.g. when cleaning up after an error)
+        """
+        if self.thread is not None:
+            self.discarding = discard
+            self.chunks.put(END)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            if not discard:
+                raise error
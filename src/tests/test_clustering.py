@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Tests for quadtree clustering.
+"""
+
+import unittest
+import numpy as np
+from clustering import build_clusters
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class BuildClustersTest(unittest.TestCase):
+    def test_weights_match_repeated_points(self):
+        latitudes = [40.1, 40.2, 45.0]
+        longitudes = [-75.1, -75.2, -70.0]
+        weights = [3, 1, 2]
+        repeated = build_clusters(np.repeat(latitudes, weights), np.repeat(longitudes, weights), [4, 8])[0]
+        weighted = build_clusters(latitudes, longitudes, [4, 8], weights=weights)[0]
+        for a, b in zip(repeated, weighted):
+            self.assertEqual(a.counts.tolist(), b.counts.tolist())
+            self.assertTrue(np.allclose(a.latitudes, b.latitudes))
+            self.assertTrue(np.allclose(a.longitudes, b.longitudes))
+        self.assertEqual(weighted[0].counts.tolist(), [4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
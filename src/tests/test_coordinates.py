@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Tests for coordinate parsing and validation.
+"""
+
+import math
+import unittest
+import numpy as np
+from coordinates import (COORDINATE_OK, COORDINATE_MISSING, COORDINATE_UNPARSEABLE, COORDINATE_OUT_OF_RANGE,
+                         COORDINATE_SWAPPED, COORDINATE_NULL_ISLAND, parse_dms, parse_coordinates,
+                         validate_coordinates)
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class ParseDmsTest(unittest.TestCase):
+    def assertDegrees(self, s, expected):
+        self.assertAlmostEqual(parse_dms(s), expected, places=6)
+
+    def test_degrees_minutes_seconds(self):
+        self.assertDegrees('40 26\' 46.3" N', 40 + 26 / 60.0 + 46.3 / 3600.0)
+        self.assertDegrees('40\xb026\'46.3"N', 40 + 26 / 60.0 + 46.3 / 3600.0)
+
+    def test_colon_separated(self):
+        self.assertDegrees('-75:09:02', -(75 + 9 / 60.0 + 2 / 3600.0))
+
+    def test_degrees_minutes(self):
+        self.assertDegrees('75 30.5 W', -(75 + 30.5 / 60.0))
+
+    def test_hemisphere_prefix_and_suffix(self):
+        self.assertDegrees('S 33 52 04', -(33 + 52 / 60.0 + 4 / 3600.0))
+        self.assertDegrees('75.5W', -75.5)
+        self.assertDegrees('75.5E', 75.5)
+        self.assertDegrees('N40.5', 40.5)
+
+    def test_invalid(self):
+        for s in ['', 'ABC', 'N 40 30 S', '40 75 00', '40 30 61', '40.5.5']:
+            self.assertTrue(math.isnan(parse_dms(s)), s)
+
+
+class ParseCoordinatesTest(unittest.TestCase):
+    def test_clean_decimal_column(self):
+        degrees, missing = parse_coordinates(['40.5', '-74.25', '0'])
+        np.testing.assert_array_equal(degrees, [40.5, -74.25, 0.0])
+        self.assertFalse(missing.any())
+
+    def test_missing_values(self):
+        degrees, missing = parse_coordinates(['40.5', '', 'NA', ' na '])
+        self.assertEqual(degrees[0], 40.5)
+        np.testing.assert_array_equal(missing, [False, True, True, True])
+
+    def test_mixed_decimal_and_dms(self):
+        degrees, missing = parse_coordinates(['40.5', '40 30 00 N', ' 41.25 ', '75.5w', '40-30', '1.2.3', 'junk'])
+        np.testing.assert_allclose(degrees[:5], [40.5, 40.5, 41.25, -75.5, 40.5])
+        self.assertTrue(np.isnan(degrees[5:]).all())
+        self.assertFalse(missing.any())
+
+
+class ValidateCoordinatesTest(unittest.TestCase):
+    def test_status_codes(self):
+        latitudes = ['40.5', '', 'junk', '95', '120', '0']
+        longitudes = ['-74.0', '-74.0', '-74.0', '-200', '45', '0']
+        latitude, longitude, status = validate_coordinates(latitudes, longitudes)
+        np.testing.assert_array_equal(status, [COORDINATE_OK, COORDINATE_MISSING, COORDINATE_UNPARSEABLE,
+                                               COORDINATE_OUT_OF_RANGE, COORDINATE_SWAPPED, COORDINATE_NULL_ISLAND])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Tests for duplicate record detection.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from dedup import DuplicateFilter, DUPLICATE_DESCRIPTION
+from pipeline import find_unique_rows
+from snapshot import InputSnapshot
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class DuplicateFilterTest(unittest.TestCase):
+    def test_first_occurrence_is_kept(self):
+        duplicates = DuplicateFilter()
+        keep = duplicates.unique_rows(['b', 'a', 'b', 'c', 'a', 'a'])
+        self.assertEqual(keep.tolist(), [0, 1, 3])
+        self.assertEqual(duplicates.summarize(), {DUPLICATE_DESCRIPTION: 3})
+
+    def test_no_rows(self):
+        duplicates = DuplicateFilter()
+        self.assertEqual(duplicates.unique_rows([]).tolist(), [])
+        self.assertEqual(duplicates.summarize(), {})
+
+
+class FindUniqueRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.snapshot_folder = InputSnapshot.snapshot_folder
+        InputSnapshot.snapshot_folder = os.path.join(self.folder, 'snapshots')
+        self.path = os.path.join(self.folder, 'cdrs.csv')
+        with open(self.path, 'wb') as f:
+            f.write('Number,Date,Time\n'
+                    '5551234,2016-01-01,10:00\n'
+                    '5551234,2016-01-01,10:00\n'
+                    '5551234,2016-01-01,11:00\n'
+                    '5559999,2016-01-02,10:00\n')
+
+    def tearDown(self):
+        InputSnapshot.snapshot_folder = self.snapshot_folder
+        shutil.rmtree(self.folder)
+
+    def test_whole_rows(self):
+        keep, rejected = find_unique_rows(self.path)
+        self.assertEqual(keep.tolist(), [0, 2, 3])
+        self.assertEqual(rejected, {DUPLICATE_DESCRIPTION: 1})
+
+    def test_key_columns(self):
+        self.assertEqual(find_unique_rows(self.path, ['Number', 'Date'])[0].tolist(), [0, 3])
+        self.assertEqual(find_unique_rows(self.path, ['Time'])[0].tolist(), [0, 2])
+
+    def test_digests_are_read_from_snapshot(self):
+        find_unique_rows(self.path, ['Number', 'Date'])
+        digests = InputSnapshot(self.path, [0, 1], kind='digests').load()
+        self.assertEqual(len(digests[0]), 4)
+        self.assertEqual(find_unique_rows(self.path, ['Number', 'Date'])[0].tolist(), [0, 3])
+        self.assertIsNone(InputSnapshot(self.path, [], kind='row digests').load())
+        self.assertEqual(find_unique_rows(self.path)[0].tolist(), [0, 2, 3])
+        self.assertIsNotNone(InputSnapshot(self.path, [], kind='row digests').load())
+
+    def test_keep_duplicates(self):
+        self.assertEqual(find_unique_rows(self.path, []), (None, {}))
+
+    def test_missing_key_column(self):
+        self.assertRaises(ValueError, find_unique_rows, self.path, ['Number', 'Tower'])
+
+
+if __name__ == '__main__':
+    unittest.main()
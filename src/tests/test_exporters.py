@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Tests for report output formats.
+"""
+
+import json
+import unittest
+import numpy as np
+from exporters import GeoJSONSink, decode_text
+from models import LocatedCDRBatch
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class DecodeTextTest(unittest.TestCase):
+    def test_utf8(self):
+        self.assertEqual(decode_text('Caf\xc3\xa9'), u'Caf\xe9')
+
+    def test_latin1_fallback(self):
+        self.assertEqual(decode_text('Caf\xe9'), u'Caf\xe9')
+
+    def test_other_values_unchanged(self):
+        self.assertEqual(decode_text(5), 5)
+
+
+class GeoJSONSinkTest(unittest.TestCase):
+    def test_properties_with_mixed_encodings(self):
+        batch = LocatedCDRBatch([1, 2], np.array([40.5, 41.0]), np.array([-75.0, -75.5]),
+                                [{'Place': 'Caf\xe9'}, {'Place': 'Caf\xc3\xa9', 'Note': 'ok'}])
+        text = GeoJSONSink(None, 'unused.geojson').render(batch)
+        features = json.loads(''.join(['[', text, ']']))
+        self.assertEqual([f['properties']['Place'] for f in features], [u'Caf\xe9', u'Caf\xe9'])
+        self.assertEqual(features[0]['geometry']['coordinates'], [-75.0, 40.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
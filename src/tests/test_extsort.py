@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Tests for the external merge sort.
+"""
+
+import random
+import unittest
+import extsort
+from extsort import external_sort
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+def make_records(count, seed=1):
+    rng = random.Random(seed)
+    return [(i, rng.random(), {'Date': '2016-01-%02d' % rng.randint(1, 28)}) for i in xrange(count)]
+
+
+def date_key(record):
+    return record[2]['Date']
+
+
+class ExternalSortTest(unittest.TestCase):
+    def test_fits_in_memory(self):
+        records = make_records(1000)
+        self.assertEqual(list(external_sort(records, date_key)), sorted(records, key=date_key))
+
+    def test_spills_to_disk(self):
+        records = make_records(5000)
+        self.assertEqual(list(external_sort(records, date_key, memory_bytes=20000)), sorted(records, key=date_key))
+
+    def test_multi_pass_merge(self):
+        records = make_records(5000)
+        fan_in = extsort.MERGE_FAN_IN
+        extsort.MERGE_FAN_IN = 3  # forces several merge passes over the runs
+        try:
+            result = list(external_sort(records, date_key, memory_bytes=5000))
+        finally:
+            extsort.MERGE_FAN_IN = fan_in
+        self.assertEqual(result, sorted(records, key=date_key))
+
+    def test_stable(self):
+        records = make_records(3000)
+        result = list(external_sort(records, date_key, memory_bytes=10000))
+        for a, b in zip(result, result[1:]):
+            if date_key(a) == date_key(b):
+                self.assertLess(a[0], b[0])  # equal keys keep import order
+
+    def test_empty(self):
+        self.assertEqual(list(external_sort([], date_key)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
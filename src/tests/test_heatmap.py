@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Tests for density heatmaps.
+"""
+
+import struct
+import unittest
+import zlib
+import numpy as np
+import heatmap
+from heatmap import DensityGrid, encode_png, render_heatmap
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+def read_chunks(png):
+    """
+    Splits PNG file contents into chunks, checking each chunk's CRC
+    :return: list of (chunk type, chunk data) pairs
+    """
+    chunks = []
+    position = 8
+    while position < len(png):
+        length = struct.unpack('>I', png[position:position + 4])[0]
+        kind = png[position + 4:position + 8]
+        data = png[position + 8:position + 8 + length]
+        crc = struct.unpack('>I', png[position + 8 + length:position + 12 + length])[0]
+        if crc != zlib.crc32(''.join([kind, data])) & 0xffffffff:
+            raise ValueError(''.join(['Bad CRC in ', kind, ' chunk']))
+        chunks.append((kind, data))
+        position += 12 + length
+    return chunks
+
+
+def decode_png(png):
+    """
+    Decodes an RGBA PNG written by encode_png (filter type 0 only)
+    :return: 3D uint8 array of RGBA pixels
+    """
+    chunks = dict(read_chunks(png))
+    width, height = struct.unpack('>II', chunks['IHDR'][:8])
+    raw = zlib.decompress(chunks['IDAT'])
+    if len(raw) != height * (width * 4 + 1):
+        raise ValueError('IDAT has the wrong size')
+    return np.frombuffer(raw, dtype=np.uint8).reshape(height, width * 4 + 1)[:, 1:].reshape(height, width, 4)
+
+
+class DensityGridTest(unittest.TestCase):
+    def setUp(self):
+        self.compact_cells = heatmap.COMPACT_CELLS
+
+    def tearDown(self):
+        heatmap.COMPACT_CELLS = self.compact_cells
+
+    def test_counts_add_up_across_batches(self):
+        heatmap.COMPACT_CELLS = 2  # merge after almost every batch
+        grid = DensityGrid(zoom=10)
+        grid.add(np.array([40.0, 40.0, 41.0]), np.array([-75.0, -75.0, -74.0]))
+        grid.add(np.array([40.0, 42.0]), np.array([-75.0, -73.0]))
+        grid.add(np.array([]), np.array([]))
+        grid.add(np.array([41.0, 42.0, 42.0]), np.array([-74.0, -73.0, -73.0]))
+        latitudes, longitudes, counts = grid.cells()
+        self.assertEqual(len(grid), 8)
+        self.assertEqual(counts.sum(), 8)
+        self.assertEqual(len(grid.keys), 1)
+        self.assertEqual(sorted(counts.tolist()), [2, 3, 3])
+        self.assertEqual(len(np.unique(grid.keys[0])), 3)
+        self.assertTrue(np.allclose(sorted(latitudes), [40.0, 41.0, 42.0], atol=0.2))
+
+    def test_empty_grid(self):
+        grid = DensityGrid()
+        self.assertEqual([len(a) for a in grid.cells()], [0, 0, 0])
+        self.assertEqual(render_heatmap(grid), [])
+
+
+class RenderHeatmapTest(unittest.TestCase):
+    def test_tiles_cover_points_and_skip_empty_tiles(self):
+        latitudes = np.array([40.0, 40.001, 41.0])
+        longitudes = np.array([-75.0, -75.001, -74.0])
+        grid = DensityGrid()
+        grid.add(latitudes, longitudes)
+        tiles = render_heatmap(grid, max_pixels=256, tile_pixels=32, radius_pixels=2)
+        self.assertTrue(tiles)
+        self.assertLess(len(tiles), (256 // 32) ** 2)  # points are in opposite corners, so most tiles are empty
+        for south, west, north, east, png in tiles:
+            self.assertTrue(decode_png(png)[..., 3].any())
+        for latitude, longitude in zip(latitudes, longitudes):
+            self.assertTrue(any(south <= latitude <= north and west <= longitude <= east
+                                for south, west, north, east, png in tiles))
+
+
+class EncodePngTest(unittest.TestCase):
+    def test_valid_png(self):
+        rgba = np.arange(3 * 5 * 4, dtype=np.uint8).reshape(3, 5, 4)
+        png = encode_png(rgba)
+        self.assertEqual(png[:8], '\x89PNG\r\n\x1a\n')
+        chunks = read_chunks(png)
+        self.assertEqual([kind for kind, data in chunks], ['IHDR', 'IDAT', 'IEND'])
+        self.assertEqual(struct.unpack('>IIBBBBB', chunks[0][1]), (5, 3, 8, 6, 0, 0, 0))
+        self.assertEqual(len(zlib.decompress(chunks[1][1])), 3 * (5 * 4 + 1))
+        self.assertEqual(decode_png(png).tolist(), rgba.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+Tests for the batch job runner.
+"""
+
+import unittest
+from jobs import run_jobs
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+def job(case_number):
+    return {'case': {'Case Number': case_number}}
+
+
+class RunJobsTest(unittest.TestCase):
+    def test_case_numbers_sharing_files_are_rejected(self):
+        self.assertRaises(ValueError, run_jobs, [job('15 0001'), job('150001')])
+        self.assertRaises(ValueError, run_jobs, [job('15-0001'), job('15-0001')])
+        self.assertRaises(ValueError, run_jobs, [job('#'), job('&')])  # both fall back to 'case'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Tests for report sorting, map point batches, and the placemark cache.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from models import CDR, Database, LocatedCDRBatch, PlacemarkCache, Report, TollsCase
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+def make_batch(dates, details=True):
+    count = len(dates)
+    batch = LocatedCDRBatch(range(1, count + 1), [40.0 + i for i in xrange(count)], [-75.0] * count,
+                            [{'Date': d} for d in dates])
+    if details:
+        batch.called_numbers = ['5551234'] * count
+        batch.cell_site_ids = [str(10 - i) for i in xrange(count)]
+        batch.sectors = ['1'] * count
+    return batch
+
+
+class SortValueTest(unittest.TestCase):
+    def test_numbers_sort_numerically(self):
+        self.assertLess(Report.sort_value('9'), Report.sort_value('10'))
+        self.assertLess(Report.sort_value('-1.5'), Report.sort_value(' 2 '))
+
+    def test_date_formats(self):
+        self.assertEqual(Report.sort_value('1/15/2016'), Report.sort_value('2016-01-15'))
+        self.assertEqual(Report.sort_value('01/15/16'), Report.sort_value('2016-01-15'))
+        self.assertLess(Report.sort_value('12/31/2015'), Report.sort_value('1/1/2016'))
+
+    def test_times(self):
+        self.assertLess(Report.sort_value('9:59 AM'), Report.sort_value('10:00'))
+        self.assertEqual(Report.sort_value('12:30 AM'), Report.sort_value('0:30'))
+        self.assertEqual(Report.sort_value('1:05 PM'), Report.sort_value('13:05:00'))
+        self.assertLess(Report.sort_value('2016-01-15 9:00'), Report.sort_value('1/15/2016 1:00 PM'))
+
+    def test_blanks_numbers_dates_then_text(self):
+        values = ['Tuesday', '2016-01-15', '', '42']
+        self.assertEqual(sorted(values, key=Report.sort_value), ['', '42', '2016-01-15', 'Tuesday'])
+
+    def test_invalid_dates_and_times_are_text(self):
+        self.assertEqual(Report.sort_value('2016-02-30'), (3, '2016-02-30'))
+        self.assertEqual(Report.sort_value('25:00'), (3, '25:00'))
+        self.assertEqual(Report.sort_value('13:00 PM'), (3, '13:00 PM'))
+
+
+class SortKeyTest(unittest.TestCase):
+    def test_report_field(self):
+        records = make_batch(['1/2/2016', '12/31/2015', '1/1/2016']).detailed_records()
+        key = Report.sort_key(['Date'], records[0])
+        self.assertEqual([r[0] for r in sorted(records, key=key)], [2, 3, 1])
+
+    def test_cell_site_and_sector(self):
+        records = make_batch(['', '', '']).detailed_records()
+        key = Report.sort_key(['Sector', 'Cell Site ID'], records[0])
+        self.assertEqual([r[5] for r in sorted(records, key=key)], ['8', '9', '10'])
+
+    def test_unknown_field(self):
+        records = make_batch(['1/1/2016']).detailed_records()
+        self.assertRaises(ValueError, Report.sort_key, ['Time'], records[0])
+
+    def test_details_not_carried(self):
+        records = make_batch(['1/1/2016'], details=False).detailed_records()
+        self.assertRaises(ValueError, Report.sort_key, ['Called Number'], records[0])
+
+
+class LocatedCDRBatchTest(unittest.TestCase):
+    def test_details_survive_select_and_concatenate(self):
+        batch = LocatedCDRBatch.concatenate([make_batch(['a', 'b']), make_batch(['c'])]).select([2, 0])
+        self.assertEqual(batch.cdr_ids, [1, 1])
+        self.assertEqual(batch.cell_site_ids, ['10', '10'])
+        self.assertEqual([r[3]['Date'] for r in batch.records()], ['c', 'a'])
+
+    def test_from_records(self):
+        batch = make_batch(['a', 'b'], details=False)
+        rebuilt = LocatedCDRBatch.from_records(batch.detailed_records())
+        self.assertFalse(rebuilt.has_details())
+        self.assertEqual(rebuilt.records(), batch.records())
+        detailed = LocatedCDRBatch.from_records(make_batch(['a']).detailed_records())
+        self.assertEqual(detailed.sectors, ['1'])
+
+
+class GenerateCDataTest(unittest.TestCase):
+    def setUp(self):
+        self.get_cdr_details = CDR.get_cdr_details
+
+        def no_query(pk, case_id):
+            raise AssertionError('details were queried again')
+        CDR.get_cdr_details = staticmethod(no_query)
+
+    def tearDown(self):
+        CDR.get_cdr_details = self.get_cdr_details
+
+    def test_resolved_point_with_no_other_fields(self):
+        cdata = CDR.generate_cdata(7, 'case', latitude=0.0, longitude=-75.0, other_fields={})
+        self.assertIn('<b>7</b>', cdata)
+        self.assertIn('-75.0', cdata)
+
+
+class PlacemarkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.active_filename = Database.active_filename
+        database = Database(os.path.join(self.folder, 'case.db'))
+        database.create_tables()
+        database.activate()
+        case = TollsCase('15-0001', 'PD', 'Agent', 'Analyst', '5551234')
+        case.save()
+        self.cache = PlacemarkCache(database.placemark_cache_filename)
+        self.report = Report(case.case_unique_id, False, self.folder, placemark_cache=self.cache)
+        self.rendered = []
+        render_placemark = self.report.render_placemark
+
+        def counting_render_placemark(cdr_id, latitude, longitude, other):
+            self.rendered.append(cdr_id)
+            return render_placemark(cdr_id, latitude, longitude, other)
+        self.report.render_placemark = counting_render_placemark
+
+    def tearDown(self):
+        self.cache.close()
+        Database.active_filename = self.active_filename
+        shutil.rmtree(self.folder)
+
+    def generate(self, batch):
+        self.rendered = []
+        self.cache.open()
+        try:
+            return self.report.generate_placemarks(batch)
+        finally:
+            self.cache.close()
+
+    def test_rerun_only_renders_changed_points(self):
+        batch = make_batch(['2015-01-01', '2015-01-02', '2015-01-03'], details=False)
+        uncached = Report(self.report.case_id, False, self.folder).generate_placemarks(batch)
+        self.assertEqual(self.generate(batch), uncached)
+        self.assertEqual(self.rendered, [1, 2, 3])
+
+        self.assertEqual(self.generate(batch), uncached)
+        self.assertEqual(self.rendered, [])
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 0))
+
+        batch.other_fields[1] = {'Date': '2015-02-02'}
+        changed = self.generate(batch)
+        self.assertEqual(self.rendered, [2])
+        self.assertIn('2015-02-02', changed)
+        self.assertEqual(changed, Report(self.report.case_id, False, self.folder).generate_placemarks(batch))
+
+    def test_fragments_are_stored_without_excess_whitespace(self):
+        self.generate(make_batch(['2015-01-01'], details=False))
+        self.cache.open()
+        fragment = self.cache.conn.execute("select Fragment_Data from FRAGMENT;").fetchone()[0]
+        self.assertEqual(str(fragment), Report.strip_whitespace(str(fragment)))
+
+
+if __name__ == '__main__':
+    unittest.main()
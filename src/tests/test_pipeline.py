@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Tests for importing towers and CDRs from separate files.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from models import CDR, Database, TollsCase, UNMATCHED_DESCRIPTION
+from pipeline import load_two_files
+from snapshot import InputSnapshot
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class LoadTwoFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.active_filename = Database.active_filename
+        self.snapshot_folder = InputSnapshot.snapshot_folder
+        InputSnapshot.snapshot_folder = os.path.join(self.folder, 'snapshots')
+        self.database = Database(os.path.join(self.folder, 'case.db'))
+        self.database.create_tables()
+        self.database.activate()
+        case = TollsCase('15-0001', 'PD', 'Agent', 'Analyst', '5551234')
+        case.save()
+        self.case_id = case.case_unique_id
+        self.tower_file = self.write_csv('towers.csv', 'Cell,Lat,Long,Sector,Azimuth\n'
+                                                       '101,40.0,-75.0,1,0\n'
+                                                       '102,40.5,-74.5,2,120\n')
+        self.cdr_file = self.write_csv('cdrs.csv', 'Number,Cell,Sector,Date\n'
+                                                   '5550001,101,1,2016-01-01\n'
+                                                   '5550002,102,2,2016-01-02\n'
+                                                   '5550001,0102,002,2016-01-03\n'
+                                                   '5550003,999,1,2016-01-04\n')
+
+    def tearDown(self):
+        InputSnapshot.snapshot_folder = self.snapshot_folder
+        Database.active_filename = self.active_filename
+        shutil.rmtree(self.folder)
+
+    def write_csv(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(text)
+        return path
+
+    def test_both_parsers_share_lookup_keys(self):
+        rejected = load_two_files(self.case_id, (self.tower_file, 0, 1, 2, 3, 4),
+                                  (self.cdr_file, 0, 1, 2, {'Date': 3}))
+        self.assertEqual(rejected, {UNMATCHED_DESCRIPTION: 1})
+
+        conn = sqlite3.connect(self.database.database_filename)
+        conn.text_factory = str
+        try:
+            for table, value_column in (('CELL_SITE', 'Cell_Site_ID'), ('SECTOR', 'Sector')):
+                values = [row[0] for row in conn.execute('select {0} from {1};'.format(value_column, table))]
+                self.assertEqual(len(values), len(set(values)), table)
+            self.assertEqual(sorted(row[0] for row in conn.execute('select Site_Match from SITE_MATCH;')),
+                             ['101/1', '102/2', '999/1'])
+            self.assertEqual(conn.execute("""
+                select count(*)
+                from CDR
+                  join TOWER on TOWER.Tower_Cell_Site_Key = CDR.CDR_Cell_Site_Key
+                         and TOWER.Tower_Sector_Key = CDR.CDR_Sector_Key;""").fetchone()[0], 2)
+        finally:
+            conn.close()
+
+        dates = [(other['Date'], latitude) for batch in CDR.get_located_batches(self.case_id)
+                 for cdr_id, latitude, longitude, other in batch.records()]
+        self.assertEqual(dates, [('2016-01-01', 40.0), ('2016-01-02', 40.5), ('2016-01-03', 40.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Tests for normalized cell site / sector matching keys.
+"""
+
+import unittest
+from sitekeys import is_hex_column, normalize_id, site_match_keys
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class NormalizeIdTest(unittest.TestCase):
+    def test_leading_zeros(self):
+        self.assertEqual(normalize_id('001234'), '1234')
+        self.assertEqual(normalize_id('0'), '0')
+        self.assertEqual(normalize_id('000'), '0')
+
+    def test_case_and_whitespace(self):
+        self.assertEqual(normalize_id('  abc  '), normalize_id('ABC'))
+
+    def test_separators(self):
+        self.assertEqual(normalize_id('310-410'), '310-410')
+        self.assertEqual(normalize_id('310 : 410'), '310-410')
+        self.assertEqual(normalize_id('310/0410'), '310-410')
+        self.assertEqual(normalize_id('-310--410-'), '310-410')
+
+    def test_marked_hex(self):
+        self.assertEqual(normalize_id('0x1A2B'), '6699')
+        self.assertEqual(normalize_id('0X1b'), '27')
+        self.assertEqual(normalize_id('1A2Bh'), '6699')
+
+    def test_implicit_hex(self):
+        self.assertEqual(normalize_id('1A2B'), '6699')
+        self.assertEqual(normalize_id('04D2-1A2B'), '1234-6699')
+
+    def test_short_or_letter_only_names_are_not_hex(self):
+        self.assertEqual(normalize_id('1B'), '1B')
+        self.assertEqual(normalize_id('A'), 'A')
+        self.assertEqual(normalize_id('BEEF'), 'BEEF')
+        self.assertEqual(normalize_id('12AG'), '12AG')
+
+    def test_digits_alone_are_decimal(self):
+        self.assertEqual(normalize_id('1234'), '1234')
+
+    def test_digits_in_hex_column_are_hex(self):
+        self.assertEqual(normalize_id('6699', hex_column=True), '26265')
+        self.assertEqual(normalize_id('1B', hex_column=True), '27')
+        self.assertEqual(normalize_id('BEEF', hex_column=True), 'BEEF')
+        self.assertEqual(normalize_id('1A2B', hex_column=False), '1A2B')
+
+    def test_hex_can_be_disabled(self):
+        self.assertEqual(normalize_id('0x1A2B', allow_hex=False), '0X1A2B')
+        self.assertEqual(normalize_id('ABCD', allow_hex=False), 'ABCD')
+
+
+class IsHexColumnTest(unittest.TestCase):
+    def test_implicit_hex_makes_column_hex(self):
+        self.assertTrue(is_hex_column(['6699', '1A2B']))
+        self.assertTrue(is_hex_column(['310-1A2B']))
+
+    def test_decimal_names_and_marked_hex(self):
+        self.assertFalse(is_hex_column(['6699', '1B', 'BEEF', '0x1A2B', '']))
+
+
+class SiteMatchKeysTest(unittest.TestCase):
+    def test_sector_zeros_stripped(self):
+        self.assertEqual(site_match_keys(['1234', '1234'], ['001', '1']), ['1234/1', '1234/1'])
+
+    def test_sector_letters_are_not_hex(self):
+        self.assertEqual(site_match_keys(['1234'], ['a']), ['1234/A'])
+        self.assertNotEqual(site_match_keys(['1234'], ['A']), site_match_keys(['1234'], ['10']))
+
+    def test_tower_and_cdr_formats_match(self):
+        towers = site_match_keys(['4660-6699', '27'], ['1', '2'])
+        cdrs = site_match_keys(['0x1234-0x1A2B', '027'], ['001', '02'])
+        self.assertEqual(towers, cdrs)
+
+    def test_hex_and_decimal_looking_ids_in_one_column_stay_apart(self):
+        self.assertEqual(site_match_keys(['1A2B', '6699'], ['1', '1']), ['6699/1', '26265/1'])
+        self.assertEqual(site_match_keys(['1A2B', '6699'], ['1', '1'], hex_cell_sites=False), ['1A2B/1', '6699/1'])
+
+    def test_short_mixed_id_does_not_match_decimal(self):
+        self.assertNotEqual(site_match_keys(['1B'], ['1']), site_match_keys(['27'], ['1']))
+
+    def test_cell_site_and_sector_stay_separate(self):
+        self.assertNotEqual(site_match_keys(['12'], ['3']), site_match_keys(['1'], ['23']))
+
+    def test_empty(self):
+        self.assertEqual(site_match_keys([], []), [])
+        self.assertEqual(site_match_keys([''], ['']), ['/'])
+
+
+if __name__ == '__main__':
+    unittest.main()
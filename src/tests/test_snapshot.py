@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Tests for input file snapshots.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from coordinates import COORDINATE_OK, COORDINATE_MISSING
+from snapshot import InputSnapshot, evict_snapshots, read_columns, read_coordinates
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.snapshot_folder = InputSnapshot.snapshot_folder
+        InputSnapshot.snapshot_folder = os.path.join(self.folder, 'snapshots')
+        self.path = os.path.join(self.folder, 'towers.csv')
+        self.write_csv('Cell,Lat,Long\n0101,40.5,-75.25\n0102,,-75\n')
+
+    def tearDown(self):
+        InputSnapshot.snapshot_folder = self.snapshot_folder
+        shutil.rmtree(self.folder)
+
+    def write_csv(self, text):
+        with open(self.path, 'wb') as f:
+            f.write(text)
+
+    def test_columns_round_trip(self):
+        self.assertEqual(read_columns(self.path, [0, 2]), (['0101', '0102'], ['-75.25', '-75']))
+        self.assertIsNotNone(InputSnapshot(self.path, [0, 2]).load())
+        self.assertEqual(read_columns(self.path, [0, 2]), (['0101', '0102'], ['-75.25', '-75']))
+
+    def test_coordinates_are_stored_parsed(self):
+        latitude, longitude, status = read_coordinates(self.path, 1, 2)
+        cached = InputSnapshot(self.path, [1, 2], kind='coordinates').load()
+        self.assertIsInstance(cached[0], np.memmap)
+        self.assertEqual(cached[0][0], 40.5)
+        self.assertEqual(cached[1].tolist(), longitude.tolist())
+        self.assertEqual(cached[2].tolist(), [COORDINATE_OK, COORDINATE_MISSING])
+
+    def test_changed_file_is_parsed_again(self):
+        read_columns(self.path, [0])
+        self.write_csv('Cell,Lat,Long\n0103,40.5,-75.25\n0104,41,-75\n')
+        self.assertEqual(read_columns(self.path, [0]), (['0103', '0104'],))
+
+    def test_touched_file_keeps_snapshot(self):
+        read_columns(self.path, [0])
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNotNone(InputSnapshot(self.path, [0]).load())
+
+    def test_least_recently_used_snapshots_are_evicted(self):
+        read_columns(self.path, [0])
+        old = InputSnapshot(self.path, [0]).snapshot_directory
+        past = time.time() - 100
+        os.utime(os.path.join(old, 'metadata'), (past, past))
+        read_columns(self.path, [1])
+        new = InputSnapshot(self.path, [1]).snapshot_directory
+        evict_snapshots(InputSnapshot.snapshot_folder, max_bytes=sum(os.path.getsize(os.path.join(new, f))
+                                                                     for f in os.listdir(new)))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Tests for limiting reports to an area through the tower spatial index.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from models import CDR, CDRBatch, Database, SpatialFilter, Tower, TowerBatch
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+# cell site, latitude, longitude, number of CDRs
+TOWERS = [('101', 40.0, -75.0, 2),
+          ('102', 40.5, -74.5, 1),
+          ('103', 40.08, -74.91, 1),  # inside the bounding box of a 10 km radius around 101, but about 12 km away
+          ('104', 40.6, -74.4, 1),  # on the edge of BOX
+          ('105', 42.0, -70.0, 1)]
+BOX = SpatialFilter.bounding_box(39.9, -75.1, 40.6, -74.4)
+
+
+class SpatialFilterTest(unittest.TestCase):
+    def test_bounding_box(self):
+        self.assertTrue(BOX.contains(40.6, -74.4))
+        self.assertFalse(BOX.contains(40.61, -74.4))
+        self.assertEqual(BOX.contains_many([40.0, 40.6, 42.0], [-75.0, -74.4, -70.0]).tolist(), [True, True, False])
+
+    def test_radius(self):
+        area = SpatialFilter.radius(40.0, -75.0, 10)
+        self.assertTrue(area.contains(40.08, -75.0))
+        self.assertTrue(area.south <= 40.08 <= area.north and area.west <= -74.91 <= area.east)
+        self.assertFalse(area.contains(40.08, -74.91))
+        self.assertEqual(area.contains_many([40.08, 40.08], [-75.0, -74.91]).tolist(), [True, False])
+
+
+class SpatialQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.active_filename = Database.active_filename
+        database = Database(os.path.join(self.folder, 'case.db'))
+        database.create_tables()
+        database.activate()
+        conn = sqlite3.connect(database.database_filename)
+        conn.text_factory = str
+        cell_sites, latitudes, longitudes, counts = zip(*TOWERS)
+        TowerBatch(1, list(cell_sites), latitudes, longitudes, ['1'] * len(TOWERS), ['0'] * len(TOWERS)).insert(conn)
+        cdr_cell_sites = [cell_site for cell_site, count in zip(cell_sites, counts) for i in xrange(count)]
+        CDRBatch(1, ['5550001'] * len(cdr_cell_sites), cdr_cell_sites, ['1'] * len(cdr_cell_sites), ['Cell'],
+                 [cdr_cell_sites]).insert(conn)
+        Tower.index_locations(conn, 0)
+        CDR.match_towers(conn, 1)
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        Database.active_filename = self.active_filename
+        shutil.rmtree(self.folder)
+
+    def cell_sites(self, spatial_filter):
+        return [other['Cell'] for batch in CDR.get_located_batches(1, spatial_filter, batch_size=2)
+                for cdr_id, latitude, longitude, other in batch.records()]
+
+    def test_bounding_box(self):
+        self.assertEqual(self.cell_sites(BOX), ['101', '101', '102', '103', '104'])
+
+    def test_radius(self):
+        self.assertEqual(self.cell_sites(SpatialFilter.radius(40.0, -75.0, 10)), ['101', '101'])
+        self.assertEqual(self.cell_sites(SpatialFilter.radius(40.0, -75.0, 20)), ['101', '101', '103'])
+
+    def test_same_points_as_filtering_every_cdr(self):
+        everything = [record for batch in CDR.get_located_batches(1) for record in batch.records()]
+        self.assertEqual(len(everything), 6)
+        for spatial_filter in (BOX, SpatialFilter.radius(40.0, -75.0, 20)):
+            self.assertEqual([record for batch in CDR.get_located_batches(1, spatial_filter)
+                              for record in batch.records()],
+                             [record for record in everything if spatial_filter.contains(record[1], record[2])])
+
+    def test_count_by_tower(self):
+        latitudes, longitudes, counts = CDR.count_by_tower(1, BOX)
+        self.assertEqual(sorted(zip(latitudes.tolist(), longitudes.tolist(), counts.tolist())),
+                         [(40.0, -75.0, 2), (40.08, -74.91, 1), (40.5, -74.5, 1), (40.6, -74.4, 1)])
+        counts = CDR.count_by_tower(1, SpatialFilter.radius(40.0, -75.0, 10))[2]
+        self.assertEqual(counts.tolist(), [2])
+
+    def test_empty_area(self):
+        self.assertEqual(self.cell_sites(SpatialFilter.bounding_box(10.0, 10.0, 11.0, 11.0)), [])
+        self.assertEqual(len(CDR.count_by_tower(1, SpatialFilter.bounding_box(10.0, 10.0, 11.0, 11.0))[2]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Tests for the background pipeline stages.
+"""
+
+import threading
+import unittest
+from stages import read_ahead
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class ReadAheadTest(unittest.TestCase):
+    def setUp(self):
+        self.closed_on = []
+
+    def numbers(self, count, fail_at=None):
+        try:
+            for i in xrange(count):
+                if i == fail_at:
+                    raise KeyError(i)
+                yield i
+        finally:
+            self.closed_on.append(threading.current_thread())
+
+    def test_all_items_in_order(self):
+        self.assertEqual(list(read_ahead(self.numbers(100), queue_size=2)), range(100))
+
+    def test_early_stop_closes_iterable_on_producer_thread(self):
+        items = read_ahead(self.numbers(100), queue_size=2)
+        self.assertEqual([next(items) for i in xrange(3)], [0, 1, 2])
+        items.close()
+        self.assertEqual(len(self.closed_on), 1)
+        self.assertIsNot(self.closed_on[0], threading.current_thread())
+
+    def test_errors_are_raised_in_caller(self):
+        items = read_ahead(self.numbers(10, fail_at=5))
+        self.assertEqual([next(items) for i in xrange(5)], range(5))
+        self.assertRaises(KeyError, next, items)
+
+
+if __name__ == '__main__':
+    unittest.main()
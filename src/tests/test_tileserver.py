@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Tests for the local KML view server.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import tileserver
+from models import CDR, CDRBatch, Database, TollsCase, Tower, TowerBatch
+from tileserver import CaseServer, ViewCache, parse_bbox, snap_bbox, view_zoom
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class ParseBboxTest(unittest.TestCase):
+    def test_bbox(self):
+        self.assertEqual(parse_bbox('BBOX=-75.5,40,-74,41.25'), (40.0, -75.5, 41.25, -74.0))
+
+    def test_view_across_antimeridian_takes_every_longitude(self):
+        self.assertEqual(parse_bbox('BBOX=170,-10,-170,10'), (-10.0, -180.0, 10.0, 180.0))
+
+    def test_clamped_to_the_globe(self):
+        self.assertEqual(parse_bbox('BBOX=-190,-95,190,95'), (-90.0, -180.0, 90.0, 180.0))
+
+    def test_invalid(self):
+        for query in ('', 'BBOX=', 'BBOX=-75,40,-74', 'BBOX=a,40,-74,41', 'BBOX=-75,nan,-74,41',
+                      'BBOX=-75,41,-74,40'):
+            self.assertIsNone(parse_bbox(query), query)
+
+
+class SnapBboxTest(unittest.TestCase):
+    def key(self, south, west, north, east):
+        zoom = view_zoom(south, west, north, east)
+        return (zoom,) + snap_bbox(south, west, north, east, zoom)
+
+    def test_nearby_views_share_a_key(self):
+        self.assertEqual(self.key(40.02, -75.03, 40.52, -74.53), self.key(40.03, -75.02, 40.53, -74.52))
+
+    def test_snapped_view_contains_view_and_is_stable(self):
+        zoom, south, west, north, east = self.key(40.02, -75.03, 40.52, -74.53)
+        self.assertTrue(south <= 40.02 and west <= -75.03 and north >= 40.52 and east >= -74.53)
+        self.assertEqual(snap_bbox(south, west, north, east, zoom), (south, west, north, east))
+
+    def test_zoom_levels_are_bounded(self):
+        self.assertEqual(view_zoom(-90, -180, 90, 180), 2)
+        self.assertEqual(view_zoom(40, -75, 40, -75), tileserver.MAX_ZOOM)
+
+
+class ViewCacheTest(unittest.TestCase):
+    def test_least_recently_used_view_is_evicted(self):
+        cache = ViewCache(max_bytes=10)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.put('c', 'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('aaaa', 'cccc'))
+        self.assertEqual(cache.size, 8)
+
+    def test_replaced_and_oversized_views(self):
+        cache = ViewCache(max_bytes=10)
+        cache.put('a', 'aaaa')
+        cache.put('a', 'aa')
+        self.assertEqual(cache.size, 2)
+        cache.put('b', 'b' * 20)  # a single view larger than the cache is still kept
+        self.assertEqual(cache.views.keys(), ['b'])
+        self.assertEqual(cache.size, 20)
+
+
+class RenderViewTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.active_filename = Database.active_filename
+        self.max_view_placemarks = tileserver.MAX_VIEW_PLACEMARKS
+        database = Database(os.path.join(self.folder, 'case.db'))
+        database.create_tables()
+        database.activate()
+        case = TollsCase('15-0001', 'PD', 'Agent', 'Analyst', '5551234')
+        case.save()
+        conn = sqlite3.connect(database.database_filename)
+        conn.text_factory = str
+        TowerBatch(case.case_unique_id, ['101', '102'], [40.1, 40.2], [-75.1, -75.2], ['1', '1'],
+                   ['0', '0']).insert(conn)
+        CDRBatch(case.case_unique_id, ['5550001'] * 3, ['101', '101', '102'], ['1'] * 3, [], []).insert(conn)
+        Tower.index_locations(conn, 0)
+        CDR.match_towers(conn, case.case_unique_id)
+        conn.commit()
+        conn.close()
+        self.server = CaseServer(case.case_unique_id, port=0)
+
+    def tearDown(self):
+        self.server.server_close()
+        tileserver.MAX_VIEW_PLACEMARKS = self.max_view_placemarks
+        Database.active_filename = self.active_filename
+        shutil.rmtree(self.folder)
+
+    def test_points_are_drawn_up_to_the_limit(self):
+        kml = self.server.render_view(8, 40.0, -76.0, 41.0, -75.0)
+        self.assertEqual(kml.count('<Placemark>'), 3)
+        self.assertNotIn('records near this location', kml)
+
+    def test_clusters_above_the_limit(self):
+        tileserver.MAX_VIEW_PLACEMARKS = 2
+        kml = self.server.render_view(8, 40.0, -76.0, 41.0, -75.0)
+        self.assertIn('records near this location', kml)
+        self.assertNotIn('<Placemark> <name><![CDATA[', kml)
+        self.assertEqual(kml.count('<Placemark>'), 2)  # one cluster per tower at this level of detail
+
+    def test_view_without_towers(self):
+        self.assertEqual(self.server.render_view(8, 10.0, 10.0, 11.0, 11.0), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
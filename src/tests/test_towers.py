@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Tests for matching CDRs to towers in a case database.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from models import (AMBIGUOUS_DESCRIPTION, UNMATCHED_DESCRIPTION, CDR, CDRBatch, Database, DimensionEncoder, Tower,
+                    TowerBatch)
+from sitekeys import is_hex_column
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+class MatchTowersTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.active_filename = Database.active_filename
+        database = Database(os.path.join(self.folder, 'case.db'))
+        database.create_tables()
+        database.activate()
+        self.conn = sqlite3.connect(database.database_filename)
+        self.conn.text_factory = str
+
+    def tearDown(self):
+        self.conn.close()
+        Database.active_filename = self.active_filename
+        shutil.rmtree(self.folder)
+
+    def load(self, towers, cdrs):
+        encoder = DimensionEncoder(self.conn)
+        cell_sites, latitudes, longitudes = zip(*towers)
+        TowerBatch(1, list(cell_sites), latitudes, longitudes, ['1'] * len(towers), ['0'] * len(towers),
+                   is_hex_column(cell_sites)).insert(self.conn, encoder)
+        CDRBatch(1, ['5551234'] * len(cdrs), cdrs, ['1'] * len(cdrs), [], [],
+                 is_hex_column(cdrs)).insert(self.conn, encoder)
+        Tower.index_locations(self.conn, 0)
+        problems = CDR.match_towers(self.conn, 1)
+        self.conn.commit()
+        return problems
+
+    def locations(self):
+        return [(cdr_id, latitude, longitude) for batch in CDR.get_located_batches(1)
+                for cdr_id, latitude, longitude, other in batch.records()]
+
+    def test_hex_and_decimal_looking_towers_do_not_collide(self):
+        problems = self.load([('1A2B', 41.0, -74.0), ('6699', 42.0, -73.0)], ['6699', '0x1A2B', '1A2Bh'])
+        self.assertEqual(problems, {})
+        self.assertEqual(self.locations(), [(1, 42.0, -73.0), (2, 41.0, -74.0), (3, 41.0, -74.0)])
+        self.assertEqual(Tower.get_tower_location(1, '6699', '1')['Latitude'], 42.0)
+
+    def test_exact_text_is_preferred(self):
+        # in the decimal CDR column "26265" is the hex tower "6699", but "6699" is written exactly as the tower was
+        self.load([('1A2B', 41.0, -74.0), ('6699', 42.0, -73.0)], ['26265', '6699'])
+        self.assertEqual(self.locations(), [(1, 42.0, -73.0), (2, 42.0, -73.0)])
+
+    def test_ambiguous_and_unmatched_are_counted(self):
+        problems = self.load([('0xFF', 43.0, -72.0), ('FFh', 44.0, -71.0), ('0101', 40.0, -75.0),
+                              ('101', 40.0, -75.0)], ['255', '255', '101', '9999', 'NA'])
+        self.assertEqual(problems, {AMBIGUOUS_DESCRIPTION: 2, UNMATCHED_DESCRIPTION: 1})
+        self.assertEqual(self.locations(), [(3, 40.0, -75.0)])
+        self.assertIsNone(Tower.get_tower_location(1, '255', '1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+Local KML server for a case that has already been imported: Google Earth loads a network link that asks for the
+placemarks in the current view whenever the camera stops, so huge cases open instantly and only visible points are
+ever rendered. Views are answered from the case database through the tower spatial index and kept in a response cache.
+
+Usage: python tileserver.py CASE_NUMBER [PORT], then add a network link to http://127.0.0.1:PORT/ in Google Earth.
+Only cases imported from separate tower and CDR files can be served (same-file data is not kept in the database).
+"""
+
+import BaseHTTPServer
+import collections
+import math
+import os
+import SocketServer
+import sys
+import threading
+import urlparse
+import numpy as np
+from clustering import build_clusters, cell_size
+from models import Database, TollsCase, CDR, SpatialFilter, Report
+
+
+__author__ = "Dan O'Day"
+__license__ = "MIT"
+__version__ = "0.1"
+__maintainer__ = "Dan O'Day"
+__email__ = "d@4n68r.com"
+__status__ = "Prototype"
+
+
+DEFAULT_PORT = 8765
+MAX_VIEW_PLACEMARKS = 2000  # views with more points than this are drawn as clusters
+VIEW_CELLS = 4  # a view is snapped outward to grid cells roughly a quarter of its width, so nearby views share entries
+CLUSTER_DETAIL = 5  # clusters are 2**CLUSTER_DETAIL times finer than the snapping grid
+MAX_ZOOM = 20
+VIEW_CACHE_BYTES = 64 * 1024 * 1024
+KML_CONTENT_TYPE = 'application/vnd.google-earth.kml+xml'
+KML_FOOTER = '</Document> </kml>'
+
+
+def parse_bbox(query):
+    """
+    Reads the view Google Earth sends as BBOX=west,south,east,north
+    :param query: URL query string
+    :return: tuple of (south, west, north, east) in decimal degrees, or None if there is no usable bounding box
+    """
+    values = urlparse.parse_qs(query).get('BBOX')
+    if not values:
+        return None
+    try:
+        west, south, east, north = [float(v) for v in values[0].split(',')]
+    except ValueError:
+        return None
+    if not all(np.isfinite([west, south, east, north])) or south > north:
+        return None
+    if west > east:  # view crosses 180 degrees, which SpatialFilter does not support, so take every longitude
+        west, east = -180.0, 180.0
+    return max(south, -90.0), max(west, -180.0), min(north, 90.0), min(east, 180.0)
+
+
+def view_zoom(south, west, north, east):
+    """
+    Picks the grid zoom level for a view, so that it spans about VIEW_CELLS grid cells
+    :return: quadtree zoom level (see clustering.cell_size)
+    """
+    span = max(north - south, east - west, 1e-9)
+    return int(min(max(math.floor(math.log(360.0 * VIEW_CELLS / span, 2)), 0), MAX_ZOOM))
+
+
+def snap_bbox(south, west, north, east, zoom):
+    """
+    Grows a view outward to the edges of the grid cells at a zoom level
+    :return: tuple of (south, west, north, east) in decimal degrees
+    """
+    size = cell_size(zoom)
+    return (max(math.floor((south + 90.0) / size) * size - 90.0, -90.0),
+            max(math.floor((west + 180.0) / size) * size - 180.0, -180.0),
+            min(math.ceil((north + 90.0) / size) * size - 90.0, 90.0),
+            min(math.ceil((east + 180.0) / size) * size - 180.0, 180.0))
+
+
+class ViewCache(object):
+    """
+    Rendered views keyed by zoom level and snapped bounding box. Least recently used views are evicted once the cache
+    grows past max_bytes. Safe to use from several request threads.
+    """
+    def __init__(self, max_bytes=VIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.views = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return ''.join(('ViewCache (', str(len(self.views)), ' views, ', str(self.size), ' bytes)'))
+
+    def __repr__(self):
+        return ''.join(('ViewCache(', repr(self.max_bytes), ')'))
+
+    def get(self, key):
+        """
+        Looks up a rendered view
+        :param key: tuple of zoom level and snapped bounding box
+        :return: KML as string, or None if not cached
+        """
+        with self.lock:
+            kml = self.views.pop(key, None)
+            if kml is None:
+                self.misses += 1
+                return None
+            self.views[key] = kml  # most recently used views are last
+            self.hits += 1
+            return kml
+
+    def put(self, key, kml):
+        """
+        Stores a rendered view
+        :param key: tuple of zoom level and snapped bounding box
+        :param kml: KML as string
+        """
+        with self.lock:
+            if key in self.views:
+                self.size -= len(self.views.pop(key))
+            self.views[key] = kml
+            self.size += len(kml)
+            while self.size > self.max_bytes and len(self.views) > 1:
+                self.size -= len(self.views.popitem(last=False)[1])
+
+
+class CaseServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server for a single case. Each request runs on its own thread with its own database connection.
+    """
+    daemon_threads = True
+
+    def __init__(self, case_id, port=DEFAULT_PORT, view_cache=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), ViewRequestHandler)  # never reachable remotely
+        self.case_id = case_id
+        self.report = Report(case_id, False, '')
+        self.view_cache = view_cache or ViewCache()
+        self.kml_header = Report.strip_whitespace(self.report.get_kml_header())
+
+    def __str__(self):
+        return self.url()
+
+    def __repr__(self):
+        return ''.join(('CaseServer(', repr(self.case_id), ', ', repr(self.server_address[1]), ')'))
+
+    def url(self):
+        """
+        :return: URL of the root document to add as a network link in Google Earth
+        """
+        return 'http://%s:%d/' % self.server_address
+
+    def root_document(self):
+        """
+        Document holding the network link that asks for the current view whenever the camera stops
+        :return: KML as string
+        """
+        return ''.join([self.kml_header, Report.strip_whitespace("""
+            <NetworkLink>
+                <name>CDRs in view</name>
+                <open>1</open>
+                <Link>
+                    <href>{url}view.kml</href>
+                    <viewRefreshMode>onStop</viewRefreshMode>
+                    <viewRefreshTime>1</viewRefreshTime>
+                    <viewFormat>BBOX=[bboxWest],[bboxSouth],[bboxEast],[bboxNorth]</viewFormat>
+                </Link>
+            </NetworkLink>""".format(url=self.url())), ' ', KML_FOOTER])
+
+    def view_document(self, south, west, north, east):
+        """
+        Gets the placemarks (or clusters, if there are too many) in a view, from the cache if possible
+        :return: KML as string
+        """
+        zoom = view_zoom(south, west, north, east)
+        key = (zoom,) + snap_bbox(south, west, north, east, zoom)
+        kml = self.view_cache.get(key)
+        if kml is None:
+            kml = ''.join([self.kml_header, ' ', self.render_view(*key), ' ', KML_FOOTER])
+            self.view_cache.put(key, kml)
+        return kml
+
+    def render_view(self, zoom, south, west, north, east):
+        """
+        Renders the points in a snapped view. CDRs are first counted per tower through the tower spatial index; only
+        if there are at most MAX_VIEW_PLACEMARKS are the CDRs themselves read and drawn, otherwise the towers are
+        clustered by their counts.
+        :return: placemark data as string
+        """
+        spatial_filter = SpatialFilter.bounding_box(south, west, north, east)
+        latitudes, longitudes, counts = CDR.count_by_tower(self.case_id, spatial_filter)
+        if counts.sum() <= MAX_VIEW_PLACEMARKS:
+            return ' '.join([self.report.generate_placemarks(batch)
+                             for batch in CDR.get_located_batches(self.case_id, spatial_filter) if len(batch)])
+
+        level = build_clusters(latitudes, longitudes, [min(zoom + CLUSTER_DETAIL, MAX_ZOOM)], weights=counts)[0][0]
+        return Report.strip_whitespace(''.join([
+            self.report.generate_cluster_placemark(level.counts[i], level.latitudes[i], level.longitudes[i], '')
+            for i in xrange(len(level))]))
+
+
+class ViewRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the root document at / and the current view at /view.kml?BBOX=west,south,east,north
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path in ('/', '/case.kml'):
+            self.send_kml(self.server.root_document())
+        elif url.path == '/view.kml':
+            bbox = parse_bbox(url.query)
+            if bbox is None:
+                self.send_error(400, "Missing or invalid BBOX")
+            else:
+                self.send_kml(self.server.view_document(*bbox))
+        else:
+            self.send_error(404)
+
+    def send_kml(self, kml):
+        self.send_response(200)
+        self.send_header('Content-Type', KML_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(kml)))
+        self.end_headers()
+        self.wfile.write(kml)
+
+    def log_message(self, format, *args):
+        pass  # Google Earth requests a view every time the camera stops
+
+
+def serve_case(case_number, port=DEFAULT_PORT):
+    """
+    Serves an imported case until interrupted
+    :param case_number: case number whose database is served
+    :param port: local port to listen on
+    :return: n/a (raises IOError if the case has not been imported)
+    """
+    database = Database.for_case(case_number)
+    if not os.path.isfile(database.database_filename):
+        raise IOError(''.join(["No database for case ", case_number, " (import it first)"]))
+    database.activate()
+    server = CaseServer(TollsCase.get_latest_case_id(), port)
+    sys.stdout.write(''.join(['Add a network link to ', server.url(), ' in Google Earth (Ctrl+C to stop).\n']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv):
+    """
+    Serves case given on the command line
+    :param argv: command line arguments (case number, optional port)
+    :return: exit code
+    """
+    if len(argv) < 2:
+        sys.stderr.write("usage: tileserver.py CASE_NUMBER [PORT]\n")
+        return 2
+    try:
+        serve_case(argv[1], int(argv[2]) if len(argv) > 2 else DEFAULT_PORT)
+    except IOError as e:
+        sys.stderr.write(''.join([str(e), '\n']))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))